@@ -4,8 +4,8 @@ from ..model.model import Model
 
 
 class Model_NewFunction(Model):
-    def __init__(self, static_trial, dynamic_trials, measurements):
-        super().__init__(static_trial, dynamic_trials, measurements)
+    def __init__(self, static_trial, dynamic_trials, measurements, **kwargs):
+        super().__init__(static_trial, dynamic_trials, measurements, **kwargs)
 
         # Add a custom function to the Model
         self.add_function('calc_axis_eye', measurements=["Bodymass", "HeadOffset"],
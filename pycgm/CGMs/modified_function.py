@@ -4,8 +4,8 @@ from ..model.model import Model
 
 
 class Model_CustomPelvis(Model):
-    def __init__(self, static_trial, dynamic_trials, measurements):
-        super().__init__(static_trial, dynamic_trials, measurements)
+    def __init__(self, static_trial, dynamic_trials, measurements, **kwargs):
+        super().__init__(static_trial, dynamic_trials, measurements, **kwargs)
 
         # Override the calc_axis_pelvis function in Model
         self.modify_function('calc_axis_pelvis', measurements=["Bodymass", "ImaginaryMeasurement"],
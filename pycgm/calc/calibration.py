@@ -0,0 +1,372 @@
+"""
+Vectorized static calibration.
+
+Computes the calibrated subject measurements of `static.getStatic`
+over every frame of the static trial at once, using the batched
+kernels of `CalcAxes` and `CalcUtils` instead of per-frame dicts.
+"""
+
+import numpy as np
+
+from .dynamic import CalcAxes
+
+ESTIMATORS = ('mean', 'median', 'trimmed')
+
+
+def estimate(values, estimator='mean', trim=0.1):
+    """Reduce per-frame values to a single value.
+
+    Parameters
+    ----------
+    values : array
+        1D array with one value per frame.
+    estimator : {'mean', 'median', 'trimmed'}, optional
+        'mean' averages every frame, so a single missing frame gives NaN.
+        'median' and 'trimmed' ignore missing frames and are robust to
+        outliers, e.g. frames where a marker was mislabeled.
+    trim : float, optional
+        Fraction of the lowest and of the highest values dropped by the
+        'trimmed' estimator. The default is 0.1.
+
+    Returns
+    -------
+    value : float
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from .calibration import estimate
+    >>> values = np.array([100.0, 101.0, 99.0, 100.0, 160.0])
+    >>> float(estimate(values))
+    112.0
+    >>> float(estimate(values, 'median'))
+    100.0
+    >>> float(estimate(values, 'trimmed', trim=0.2))
+    100.33333333333333
+    """
+    if estimator == 'mean':
+        return np.mean(values)
+
+    values = values[~np.isnan(values)]
+
+    if estimator == 'median':
+        return np.median(values)
+
+    if estimator == 'trimmed':
+        cut = int(trim * len(values))
+        return np.mean(np.sort(values)[cut:len(values) - cut])
+
+    raise ValueError(f'unknown estimator {estimator}, expected one of {ESTIMATORS}')
+
+
+def stable_stance(markers, window):
+    """Find the frames of a static trial in which the subject moves the least.
+
+    Parameters
+    ----------
+    markers : dict
+        Maps each marker name to a (frames, 3) array of its positions.
+    window : int
+        Number of consecutive frames to find, at least 2.
+
+    Returns
+    -------
+    frames : slice
+        The `window` consecutive frames with the smallest mean marker
+        displacement, or every frame if the trial is not longer than `window`.
+    """
+    if window < 2:
+        raise ValueError('the stance window must be at least 2 frames')
+
+    positions = np.stack([np.asarray(position, dtype=float) for position in markers.values()])
+    num_frames = positions.shape[1]
+    if num_frames <= window:
+        return slice(None)
+
+    # mean displacement of the visible markers between consecutive frames
+    steps = np.linalg.norm(np.diff(positions, axis=1), axis=2)
+    visible = ~np.isnan(steps)
+    count = visible.sum(axis=0)
+    motion = np.where(visible, steps, 0).sum(axis=0) / np.maximum(count, 1)
+    motion[count == 0] = np.inf
+
+    # a window of n frames spans n - 1 steps
+    totals = np.convolve(motion, np.ones(window - 1), mode='valid')
+    start = int(np.argmin(totals))
+
+    return slice(start, start + window)
+
+
+class CalcStatic():
+    """Static calibration.
+
+    Parameters
+    ----------
+    estimator : {'mean', 'median', 'trimmed'}, optional
+        Estimator of the anthropometric measurements taken from the static
+        markers when the VSK has none: the inter-ASIS distance and the knee
+        and ankle widths. See `estimate`. The default 'mean' matches
+        `static.getStatic`.
+    trim : float, optional
+        Fraction trimmed from each end by the 'trimmed' estimator.
+    stance_window : int, optional
+        If set, only the `stance_window` consecutive frames in which the
+        subject is most still are used for calibration. See `stable_stance`.
+        Every frame is used by default.
+    """
+
+    def __init__(self, estimator='mean', trim=0.1, stance_window=None):
+        if estimator not in ESTIMATORS:
+            raise ValueError(f'unknown estimator {estimator}, expected one of {ESTIMATORS}')
+
+        self.axes = CalcAxes()
+        self.estimator = estimator
+        self.trim = trim
+        self.stance_window = stance_window
+
+    def get_static(self, markers, vsk, flat_foot=False, GCS=None):
+        """Calculate the calibrated subject measurements of a static trial.
+
+        Parameters
+        ----------
+        markers : dict
+            Maps each marker name to a (frames, 3) array of its positions
+            in the static trial. Missing markers are treated as NaN.
+        vsk : dict
+            Dictionary of the subject measurements from a VSK file.
+        flat_foot : bool, optional
+            A boolean indicating if the feet are flat or not.
+            The default value is False.
+        GCS : array, optional
+            The Global Coordinate System. Defaults to the identity.
+
+        Returns
+        -------
+        cal_sm : dict
+            The calibrated measurements, with the same keys and values as
+            `static.getStatic`.
+        """
+        if self.stance_window is not None:
+            labeled = {name: position for name, position in markers.items() if not name.startswith('*')}
+            frames = stable_stance(labeled, self.stance_window)
+            markers = {name: position[frames] for name, position in markers.items()}
+
+        num_frames = np.shape(markers['RASI'])[0]
+
+        def marker(name):
+            if name in markers:
+                return np.asarray(markers[name], dtype=float)
+            return np.full((num_frames, 3), np.nan)
+
+        cal_sm = {}
+        left_leg_length = vsk['LeftLegLength']
+        right_leg_length = vsk['RightLegLength']
+        cal_sm['MeanLegLength'] = (left_leg_length + right_leg_length) / 2.0
+        cal_sm['Bodymass'] = vsk['Bodymass']
+
+        # Define the global coordinate system
+        cal_sm['GCS'] = [[1, 0, 0], [0, 1, 0], [0, 0, 1]] if GCS is None else GCS
+
+        if vsk['LeftAsisTrocanterDistance'] != 0 and vsk['RightAsisTrocanterDistance'] != 0:
+            cal_sm['L_AsisToTrocanterMeasure'] = vsk['LeftAsisTrocanterDistance']
+            cal_sm['R_AsisToTrocanterMeasure'] = vsk['RightAsisTrocanterDistance']
+        else:
+            cal_sm['R_AsisToTrocanterMeasure'] = (0.1288 * right_leg_length) - 48.56
+            cal_sm['L_AsisToTrocanterMeasure'] = (0.1288 * left_leg_length) - 48.56
+
+        if vsk['InterAsisDistance'] != 0:
+            cal_sm['InterAsisDistance'] = vsk['InterAsisDistance']
+        else:
+            cal_sm['InterAsisDistance'] = self.calc_distance_estimate(marker('RASI'), marker('LASI'))
+
+        # Widths missing from the VSK are measured from the medial markers, if any
+        has_knee_widths = 'RightKneeWidth' in vsk and 'LeftKneeWidth' in vsk
+        cal_sm['RightKneeWidth'] = vsk['RightKneeWidth'] if has_knee_widths else 0
+        cal_sm['LeftKneeWidth'] = vsk['LeftKneeWidth'] if has_knee_widths else 0
+
+        if cal_sm['RightKneeWidth'] == 0 and 'RMKN' in markers:
+            # medial knee markers are available
+            cal_sm['RightKneeWidth'] = self.calc_distance_estimate(marker('RKNE'), marker('RMKN'))
+            cal_sm['LeftKneeWidth'] = self.calc_distance_estimate(marker('LKNE'), marker('LMKN'))
+
+        has_ankle_widths = 'RightAnkleWidth' in vsk and 'LeftAnkleWidth' in vsk
+        cal_sm['RightAnkleWidth'] = vsk['RightAnkleWidth'] if has_ankle_widths else 0
+        cal_sm['LeftAnkleWidth'] = vsk['LeftAnkleWidth'] if has_ankle_widths else 0
+
+        # getStatic checks for the medial knee markers here as well
+        if cal_sm['RightAnkleWidth'] == 0 and 'RMKN' in markers:
+            cal_sm['RightAnkleWidth'] = self.calc_distance_estimate(marker('RMMA'), marker('RANK'))
+            cal_sm['LeftAnkleWidth'] = self.calc_distance_estimate(marker('LMMA'), marker('LANK'))
+
+        for key in ['RightTibialTorsion', 'LeftTibialTorsion',
+                    'RightShoulderOffset', 'LeftShoulderOffset',
+                    'RightElbowWidth', 'LeftElbowWidth',
+                    'RightWristWidth', 'LeftWristWidth',
+                    'RightHandThickness', 'LeftHandThickness']:
+            cal_sm[key] = vsk[key]
+
+        # Joint centers of every frame, from the batched dynamic kernels
+        sacr = marker('SACR') if 'SACR' in markers else None
+        pelvis = self.axes.calc_axis_pelvis(marker('RASI'), marker('LASI'), marker('RPSI'), marker('LPSI'), sacr)
+
+        r_hip_jc, l_hip_jc = self.axes.calc_joint_center_hip(pelvis, cal_sm['MeanLegLength'],
+                                                             cal_sm['R_AsisToTrocanterMeasure'],
+                                                             cal_sm['L_AsisToTrocanterMeasure'],
+                                                             cal_sm['InterAsisDistance'])
+
+        r_knee, l_knee = self.axes.calc_axis_knee(marker('RTHI'), marker('LTHI'), marker('RKNE'), marker('LKNE'),
+                                                  r_hip_jc, l_hip_jc,
+                                                  cal_sm['RightKneeWidth'], cal_sm['LeftKneeWidth'])
+
+        # Tibial torsion is applied below, calc_axis_ankle is only used for the untwisted axes
+        r_ankle, l_ankle = self.axes.calc_axis_ankle(marker('RTIB'), marker('LTIB'), marker('RANK'), marker('LANK'),
+                                                     r_knee, l_knee,
+                                                     cal_sm['RightAnkleWidth'], cal_sm['LeftAnkleWidth'], 0, 0)
+
+        r_ankle_flexion = self.calc_ankle_flexion_axis(r_ankle, cal_sm['RightTibialTorsion'])
+        l_ankle_flexion = self.calc_ankle_flexion_axis(l_ankle, cal_sm['LeftTibialTorsion'])
+
+        r_ankle_jc, l_ankle_jc = r_ankle[:, :, 3], l_ankle[:, :, 3]
+        rtoe, ltoe = marker('RTOE'), marker('LTOE')
+        rhee, lhee = marker('RHEE'), marker('LHEE')
+
+        # Static offsets between the uncorrected and corrected foot axes
+        r_uncorrected = self.calc_uncorrected_foot_axis(rtoe, r_ankle_jc, r_ankle_flexion)
+        l_uncorrected = self.calc_uncorrected_foot_axis(ltoe, l_ankle_jc, l_ankle_flexion)
+
+        if flat_foot:
+            r_corrected = self.calc_flat_foot_axis(rtoe, rhee, r_ankle_jc, r_ankle_flexion, vsk['RightSoleDelta'])
+            l_corrected = self.calc_flat_foot_axis(ltoe, lhee, l_ankle_jc, l_ankle_flexion, vsk['LeftSoleDelta'])
+        else:
+            r_corrected = self.calc_non_flat_foot_axis(rtoe, rhee, r_ankle_flexion)
+            l_corrected = self.calc_non_flat_foot_axis(ltoe, lhee, l_ankle_flexion)
+
+        r_offset = np.mean(self.calc_ankle_offset_angle(r_uncorrected, r_corrected), axis=0)
+        l_offset = np.mean(self.calc_ankle_offset_angle(l_uncorrected, l_corrected), axis=0)
+
+        head = self.axes.calc_axis_head(marker('LFHD'), marker('RFHD'), marker('LBHD'), marker('RBHD'), 0)
+        head_offset = np.mean(self.calc_head_offset_angle(head[:, :, :3].transpose(0, 2, 1)))
+
+        cal_sm['RightStaticRotOff'] = r_offset[0] * -1
+        cal_sm['RightStaticPlantFlex'] = r_offset[1]
+        cal_sm['LeftStaticRotOff'] = l_offset[0]
+        cal_sm['LeftStaticPlantFlex'] = l_offset[1]
+        cal_sm['HeadOffset'] = head_offset
+
+        return cal_sm
+
+    def calc_distance_estimate(self, p0, p1):
+        """Distance between two (frames, 3) marker trajectories, reduced
+        over frames with the calibration's estimator."""
+        return estimate(np.linalg.norm(p0 - p1, axis=1), self.estimator, self.trim)
+
+    def calc_ankle_flexion_axis(self, ankle_axis, tibial_torsion):
+        """Rotate the ankle y axis about the ankle z axis by the tibial torsion.
+
+        Parameters
+        ----------
+        ankle_axis : array
+            (frames, 3, 4) untwisted ankle axis, as returned by calc_axis_ankle
+            with no torsion.
+        tibial_torsion : float
+            Tibial torsion in degrees.
+
+        Returns
+        -------
+        y_axis : array
+            (frames, 3) unit flexion axis of the ankle.
+        """
+        torsion = np.radians(tibial_torsion)
+        return np.sin(torsion) * ankle_axis[:, :, 0] + np.cos(torsion) * ankle_axis[:, :, 1]
+
+    def calc_uncorrected_foot_axis(self, toe, ankle_jc, ankle_flexion):
+        """Foot axis from the toe marker and the ankle joint center.
+
+        Returns
+        -------
+        axis : array
+            (frames, 3, 3) foot axis, with the x, y, z unit vectors as rows.
+        """
+        z_axis = normalize(ankle_jc - toe)
+        y_flex = normalize(ankle_flexion)
+        x_axis = normalize(np.cross(y_flex, z_axis))
+        y_axis = normalize(np.cross(z_axis, x_axis))
+
+        return np.stack([x_axis, y_axis, z_axis], axis=1)
+
+    def calc_non_flat_foot_axis(self, toe, hee, ankle_flexion):
+        """Foot axis along the heel to toe direction.
+
+        Returns
+        -------
+        axis : array
+            (frames, 3, 3) foot axis, with the x, y, z unit vectors as rows.
+        """
+        z_axis = normalize(hee - toe)
+        y_flex = normalize(ankle_flexion)
+        x_axis = normalize(np.cross(y_flex, z_axis))
+        y_axis = normalize(np.cross(z_axis, x_axis))
+
+        return np.stack([x_axis, y_axis, z_axis], axis=1)
+
+    def calc_flat_foot_axis(self, toe, hee, ankle_jc, ankle_flexion, sole_delta):
+        """Foot axis of a flat foot, with the heel and toe at the same height.
+
+        Returns
+        -------
+        axis : array
+            (frames, 3, 3) foot axis, with the x, y, z unit vectors as rows.
+        """
+        sole = np.array([0, 0, sole_delta])
+
+        z_axis = normalize(ankle_jc + sole - toe)
+
+        hee_to_toe = hee - toe
+        hee_to_toe[:, 2] = 0
+        hee_to_toe = normalize(hee_to_toe)
+
+        a = normalize(np.cross(hee_to_toe, z_axis))
+        b = normalize(np.cross(a, hee_to_toe))
+        z_axis = normalize(np.cross(b, a))
+
+        # the flexion axis is relative to the lowered ankle joint center
+        y_flex = normalize(ankle_flexion - sole)
+        x_axis = normalize(np.cross(y_flex, z_axis))
+        y_axis = normalize(np.cross(z_axis, x_axis))
+        z_axis = normalize(np.cross(x_axis, y_axis))
+
+        return np.stack([x_axis, y_axis, z_axis], axis=1)
+
+    def calc_ankle_offset_angle(self, axis_p, axis_d):
+        """Angles of the distal axis in the proximal axis, in radians.
+
+        Returns
+        -------
+        angles : array
+            (frames, 3) alpha, beta and gamma angles of each frame.
+        """
+        m = np.matmul(axis_d, np.linalg.inv(axis_p))
+
+        alpha = np.arctan(m[:, 2, 1] / np.sqrt(m[:, 2, 0]**2 + m[:, 2, 2]**2))
+        beta = np.arctan(-1 * m[:, 2, 0] / m[:, 2, 2])
+        gamma = np.arctan(-1 * m[:, 0, 1] / m[:, 1, 1])
+
+        return np.column_stack([alpha, beta, gamma])
+
+    def calc_head_offset_angle(self, head_axis):
+        """Head offset angle of each frame, in radians.
+
+        Parameters
+        ----------
+        head_axis : array
+            (frames, 3, 3) head axis, with the x, y, z unit vectors as rows.
+        """
+        global_axis = np.array([[0, 1, 0], [-1, 0, 0], [0, 0, 1]])
+        m = np.matmul(head_axis, np.linalg.inv(global_axis))
+
+        return np.arctan(m[:, 0, 2] / m[:, 2, 2])
+
+
+def normalize(v):
+    """Scale each row of a (frames, 3) array to unit length."""
+    return v / np.linalg.norm(v, axis=1)[:, np.newaxis]
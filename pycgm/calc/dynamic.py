@@ -169,27 +169,8 @@ class CalcAxes():
         left_hip_jc = left_hip_jc+pel_origin
         right_hip_jc = right_hip_jc+pel_origin
 
-        num_frames = pelvis.shape[0]
-
-        right = np.zeros((num_frames, 4, 3))
-        x = np.zeros((num_frames, 3))
-        y = np.zeros((num_frames, 3))
-        z = np.zeros((num_frames, 3))
-        o = right_hip_jc
-
-        right_stack = np.column_stack([x, y, z, o])
-        right_hip_jc_matrix = right_stack.reshape(num_frames, 4, 3).transpose(0,2,1)
-
-        left = np.zeros((num_frames, 4, 3))
-        x = np.zeros((num_frames, 3))
-        y = np.zeros((num_frames, 3))
-        z = np.zeros((num_frames, 3))
-        o = left_hip_jc
-
-        left_stack = np.column_stack([x, y, z, o])
-        left_hip_jc_matrix = left_stack.reshape(num_frames, 4, 3).transpose(0,2,1)
-
-        hip_jc = np.array([right_hip_jc_matrix, left_hip_jc_matrix])
+        # Joint centers are returned as points, they have no axes
+        hip_jc = np.array([right_hip_jc, left_hip_jc])
 
         return hip_jc
 
@@ -254,7 +235,7 @@ class CalcAxes():
         x = pelvis_axis[:, :, 0]
         y = pelvis_axis[:, :, 1]
         z = pelvis_axis[:, :, 2]
-        o = hipaxis_center[:, :, 3]
+        o = hipaxis_center
 
         num_frames = pelvis_axis.shape[0]
         hip_stack = np.column_stack([x, y, z, o])
@@ -335,8 +316,6 @@ class CalcAxes():
         mm = 7.0
         r_delta = (rkne_width/2.0) + mm
         l_delta = (lkne_width/2.0) + mm
-        r_hip_jc = r_hip_jc[:, :, 3]
-        l_hip_jc = l_hip_jc[:, :, 3]
 
         # Determine the position of kneeJointCenter using calc_joint_center function
         r_knee_o = CalcUtils.calc_joint_center(rthi, r_hip_jc, rkne, r_delta)
@@ -977,8 +956,9 @@ class CalcAxes():
 
         thorax_origin = thorax_axis[:, :, 3]
 
+        # Normalized into a new array, the thorax axis is shared with other functions
         axis_x_vec  = thorax_axis[:, :, 0]
-        axis_x_vec /= np.linalg.norm(axis_x_vec, axis=1)[:, np.newaxis]
+        axis_x_vec  = axis_x_vec / np.linalg.norm(axis_x_vec, axis=1)[:, np.newaxis]
 
         r_sho_vec  = rsho - thorax_origin
         r_sho_vec /= np.linalg.norm(r_sho_vec, axis=1)[:, np.newaxis]
@@ -994,20 +974,7 @@ class CalcAxes():
         l_wand /= np.linalg.norm(l_wand, axis=1)[:, np.newaxis]
         l_wand += thorax_origin
 
-        num_frames = rsho.shape[0]
-        x = np.zeros((num_frames, 3))
-        y = np.zeros((num_frames, 3))
-        z = np.zeros((num_frames, 3))
-        o = r_wand
-
-        right_stack = np.column_stack([x, y, z, o])
-        right_wand_matrix = right_stack.reshape(num_frames, 4, 3).transpose(0, 2, 1)
-
-        o = l_wand
-        left_stack = np.column_stack([x, y, z, o])
-        left_wand_matrix = left_stack.reshape(num_frames, 4, 3).transpose(0, 2, 1)
-
-        return np.array([right_wand_matrix, left_wand_matrix])
+        return np.array([r_wand, l_wand])
 
 
     def calc_joint_center_shoulder(self, rsho, lsho, thorax_axis, r_wand, l_wand, r_sho_off, l_sho_off):
@@ -1037,7 +1004,8 @@ class CalcAxes():
         Returns
         -------
         shoulder_JC : array
-            4x4 affine matrix containing the right and left shoulders joint centers.
+            A 2x3 array containing the (x, y, z) positions of the right and
+            left shoulder joint centers.
 
 
         Examples
@@ -1069,9 +1037,6 @@ class CalcAxes():
         thorax_axis = np.asarray(thorax_axis)
         thorax_origin = thorax_axis[:, :, 3]
 
-        r_wand = r_wand[:, :, 3]
-        l_wand = l_wand[:, :, 3]
-
         # Get Subject Measurement Values
         mm = 7.0
         r_delta = (r_sho_off + mm)
@@ -1084,20 +1049,7 @@ class CalcAxes():
         r_sho_jc = CalcUtils.calc_joint_center(r_wand, thorax_origin, rsho, r_delta)
         l_sho_jc = CalcUtils.calc_joint_center(l_wand, thorax_origin, lsho, l_delta)
 
-        num_frames = rsho.shape[0]
-        x = np.zeros((num_frames, 3))
-        y = np.zeros((num_frames, 3))
-        z = np.zeros((num_frames, 3))
-        o = r_sho_jc
-
-        right_stack = np.column_stack([x, y, z, o])
-        right_shoulder_jc_matrix = right_stack.reshape(num_frames, 4, 3).transpose(0,2,1)
-
-        o = l_sho_jc
-        left_stack = np.column_stack([x, y, z, o])
-        left_shoulder_jc_matrix = left_stack.reshape(num_frames, 4, 3).transpose(0,2,1)
-
-        return np.array([right_shoulder_jc_matrix, left_shoulder_jc_matrix])
+        return np.array([r_sho_jc, l_sho_jc])
 
 
     def calc_axis_shoulder(self, thorax_axis, r_sho_jc, l_sho_jc, r_wand, l_wand):
@@ -1157,12 +1109,6 @@ class CalcAxes():
                 [   0.  ,    0.  ,    0.  ,    1.  ]])]
         """
 
-        r_sho_jc = r_sho_jc[:, :, 3]
-        l_sho_jc = l_sho_jc[:, :, 3]
-
-        r_wand = r_wand[:, :, 3]
-        l_wand = l_wand[:, :, 3]
-
         thorax_origin = thorax_axis[:, :, 3]
 
         r_wand_direc  = r_wand - thorax_origin
@@ -1252,10 +1198,10 @@ class CalcAxes():
         Returns
         -------
         [r_axis, l_axis, r_wri_origin, l_wri_origin] : array
-            An array consisting of a 4x4 affine matrix representing the
+            A list consisting of a 4x4 affine matrix representing the
             right elbow axis, a 4x4 affine matrix representing the left 
-            elbow axis, a 4x4 affine matrix representing the right wrist
-            origin, and a 4x4 affine matrix representing the left wrist origin.
+            elbow axis, and the (x, y, z) positions of the right and left
+            wrist origins.
 
         Examples
         --------
@@ -1405,20 +1351,9 @@ class CalcAxes():
         l_elbow_axis_stack  = np.column_stack([x_axis, y_axis, z_axis, lejc])
         l_elbow_axis_matrix = l_elbow_axis_stack.reshape(num_frames, 4, 3).transpose(0, 2, 1)
 
-        x = np.zeros((num_frames, 3))
-        y = np.zeros((num_frames, 3))
-        z = np.zeros((num_frames, 3))
-        o = rwjc
-
-        r_wrist_jc_stack = np.column_stack([x, y, z, o])
-        r_wrist_jc_matrix = r_wrist_jc_stack.reshape(num_frames, 4, 3).transpose(0,2,1)
-
-        o = lwjc
-
-        l_wrist_jc_stack = np.column_stack([x, y, z, o])
-        l_wrist_jc_matrix = l_wrist_jc_stack.reshape(num_frames, 4, 3).transpose(0,2,1)
-        
-        return np.asarray([r_elbow_axis_matrix, l_elbow_axis_matrix, r_wrist_jc_matrix, l_wrist_jc_matrix])
+        # The wrist joint centers are points, so they are returned alongside the
+        # elbow axes in a list rather than stacked with them
+        return [r_elbow_axis_matrix, l_elbow_axis_matrix, rwjc, lwjc]
 
 
     def calc_axis_wrist(self, r_elbow, l_elbow, r_wrist_jc, l_wrist_jc):
@@ -1434,9 +1369,9 @@ class CalcAxes():
         l_elbow : array
             4x4 affine matrix representing the left elbow axis and origin
         r_wrist_jc : array
-            4x4 affine matrix representing the right wrist joint center
+            (x, y, z) position of the right wrist joint center
         l_wrist_jc : array
-            4x4 affine matrix representing the left wrist joint center
+            (x, y, z) position of the left wrist joint center
 
         Returns
         --------
@@ -1495,13 +1430,13 @@ class CalcAxes():
         r_elbow_flex = r_elbow[:, :, 1]
         l_elbow_flex = l_elbow[:, :, 1]
 
-        rwjc = r_wrist_jc[:, :, 3]
-        lwjc = l_wrist_jc[:, :, 3]
+        rwjc = r_wrist_jc
+        lwjc = l_wrist_jc
 
         # this is the axis of radius
-        # right
-        y_axis  = r_elbow_flex
-        y_axis /= np.linalg.norm(y_axis, axis=1)[:, np.newaxis]
+        # right, normalized into a new array since the elbow axes are shared
+        # with the functions that run after this one
+        y_axis  = r_elbow_flex / np.linalg.norm(r_elbow_flex, axis=1)[:, np.newaxis]
 
         z_axis  = np.subtract(rejc, rwjc)
         z_axis /= np.linalg.norm(z_axis, axis=1)[:, np.newaxis]
@@ -1517,8 +1452,7 @@ class CalcAxes():
         r_wrist_axis_matrix = r_wrist_axis_stack.reshape(num_frames, 4, 3).transpose(0, 2, 1)
 
         # left
-        y_axis  = l_elbow_flex
-        y_axis /= np.linalg.norm(y_axis, axis=1)[:, np.newaxis]
+        y_axis  = l_elbow_flex / np.linalg.norm(l_elbow_flex, axis=1)[:, np.newaxis]
 
         z_axis  = np.subtract(lejc, lwjc)
         z_axis /= np.linalg.norm(z_axis, axis=1)[:, np.newaxis]
@@ -1561,9 +1495,9 @@ class CalcAxes():
         lfin : array
             1x3 LFIN marker
         r_wrist_jc : array
-            4x4 affine matrix representing the right wrist joint center
+            (x, y, z) position of the right wrist joint center
         l_wrist_jc : array
-            4x4 affine matrix representing the left wrist joint center
+            (x, y, z) position of the left wrist joint center
         r_hand_thickness : float
             The thickness of the right hand
         l_hand_thickness : float
@@ -1628,8 +1562,8 @@ class CalcAxes():
         rwri = (rwra + rwrb) / 2.0
         lwri = (lwra + lwrb) / 2.0
 
-        rwjc = r_wrist_jc[:, :, 3]
-        lwjc = l_wrist_jc[:, :, 3]
+        rwjc = r_wrist_jc
+        lwjc = l_wrist_jc
 
         mm = 7.0
 
@@ -10,6 +10,8 @@ from math import acos, cos, radians, sin, sqrt
 
 import numpy as np
 
+from .calibration import estimate, stable_stance
+
 
 def rotmat(x=0,y=0,z=0):
     """Rotation Matrix function
@@ -102,7 +104,38 @@ def getDist(p0, p1):
     """
     return sqrt((p0[0] - p1[0])**2 + (p0[1] - p1[1])**2 + (p0[2] - p1[2])**2)
 
-def getStatic(motionData,vsk,flat_foot=False,GCS=None):
+def frameDistances(motionData, p0, p1):
+    """Frame Distances function
+
+    Calculates the distance between two markers in every frame at once.
+
+    Parameters
+    ----------
+    motionData : list
+        List of frame dictionaries of marker positions.
+    p0, p1 : str
+        Names of the two markers.
+
+    Returns
+    -------
+    dist : array
+        The distance between the markers in each frame.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from .static import frameDistances
+    >>> motionData = [{'RASI': np.array([395.37, 428.1, 1036.83]), 'LASI': np.array([183.19, 422.79, 1033.07])},
+    ...               {'RASI': np.array([395.37, 428.1, 1036.83]), 'LASI': np.array([185.19, 422.79, 1033.07])}]
+    >>> np.around(frameDistances(motionData, 'RASI', 'LASI'), 2)
+    array([212.28, 210.28])
+    """
+    a = np.array([frame[p0] for frame in motionData], dtype=float)
+    b = np.array([frame[p1] for frame in motionData], dtype=float)
+
+    return np.linalg.norm(a - b, axis=1)
+
+def getStatic(motionData,vsk,flat_foot=False,GCS=None,estimator='mean',trim=0.1,stance_window=None):
     """ Get Static Offset function
 
     Calculate the static offset angle values and return the values in radians
@@ -119,6 +152,15 @@ def getStatic(motionData,vsk,flat_foot=False,GCS=None):
     GCS : array, optional
         An array containing the Global Coordinate System.
         If not provided, the default will be set to: [[1, 0, 0], [0, 1, 0], [0, 0, 1]].
+    estimator : {'mean', 'median', 'trimmed'}, optional
+        Estimator of the inter-ASIS distance and knee and ankle widths
+        measured from the markers when the VSK has none.
+        See `calibration.estimate`. The default is 'mean'.
+    trim : float, optional
+        Fraction trimmed from each end by the 'trimmed' estimator.
+    stance_window : int, optional
+        If set, only the `stance_window` consecutive frames in which the
+        subject is most still are used. See `calibration.stable_stance`.
 
     Returns
     -------
@@ -145,9 +187,13 @@ def getStatic(motionData,vsk,flat_foot=False,GCS=None):
     >>> result['LeftTibialTorsion']
     0.0
     """
+    if stance_window is not None:
+        labeled = [name for name in motionData[0] if not name.startswith('*')]
+        positions = {name: [frame[name] for frame in motionData] for name in labeled}
+        motionData = motionData[stable_stance(positions,stance_window)]
+
     static_offset = []
     head_offset = []
-    IAD = []
     calSM = {}
     LeftLegLength = vsk['LeftLegLength']
     RightLegLength = vsk['RightLegLength']
@@ -167,11 +213,8 @@ def getStatic(motionData,vsk,flat_foot=False,GCS=None):
     if vsk['InterAsisDistance'] != 0:
         calSM['InterAsisDistance'] = vsk['InterAsisDistance']
     else:
-        for frame in motionData:
-            iadCalc = IADcalculation(frame)
-            IAD.append(iadCalc)
-        InterAsisDistance = np.average(IAD)
-        calSM['InterAsisDistance'] = InterAsisDistance
+        IAD = frameDistances(motionData,'RASI','LASI')
+        calSM['InterAsisDistance'] = estimate(IAD,estimator,trim)
 
     try:
         calSM['RightKneeWidth'] = vsk['RightKneeWidth']
@@ -185,23 +228,11 @@ def getStatic(motionData,vsk,flat_foot=False,GCS=None):
     if calSM['RightKneeWidth'] == 0:
         if 'RMKN' in list(motionData[0].keys()):
             #medial knee markers are available
-            Rwidth = []
-            Lwidth = []
-            #average each frame
-            for frame in motionData:
-                RMKN = frame['RMKN']
-                LMKN = frame['LMKN']
-
-                RKNE = frame['RKNE']
-                LKNE = frame['LKNE']
-
-                Rdst = getDist(RKNE,RMKN)
-                Ldst = getDist(LKNE,LMKN)
-                Rwidth.append(Rdst)
-                Lwidth.append(Ldst)
-
-            calSM['RightKneeWidth'] = sum(Rwidth)/len(Rwidth)
-            calSM['LeftKneeWidth'] = sum(Lwidth)/len(Lwidth)
+            Rwidth = frameDistances(motionData,'RKNE','RMKN')
+            Lwidth = frameDistances(motionData,'LKNE','LMKN')
+
+            calSM['RightKneeWidth'] = estimate(Rwidth,estimator,trim)
+            calSM['LeftKneeWidth'] = estimate(Lwidth,estimator,trim)
     try:
         calSM['RightAnkleWidth'] = vsk['RightAnkleWidth']
         calSM['LeftAnkleWidth'] = vsk['LeftAnkleWidth']
@@ -214,23 +245,11 @@ def getStatic(motionData,vsk,flat_foot=False,GCS=None):
     if calSM['RightAnkleWidth'] == 0:
         if 'RMKN' in list(motionData[0].keys()):
             #medial knee markers are available
-            Rwidth = []
-            Lwidth = []
-            #average each frame
-            for frame in motionData:
-                RMMA = frame['RMMA']
-                LMMA = frame['LMMA']
-
-                RANK = frame['RANK']
-                LANK = frame['LANK']
-
-                Rdst = getDist(RMMA,RANK)
-                Ldst = getDist(LMMA,LANK)
-                Rwidth.append(Rdst)
-                Lwidth.append(Ldst)
-
-            calSM['RightAnkleWidth'] = sum(Rwidth)/len(Rwidth)
-            calSM['LeftAnkleWidth'] = sum(Lwidth)/len(Lwidth)
+            Rwidth = frameDistances(motionData,'RMMA','RANK')
+            Lwidth = frameDistances(motionData,'LMMA','LANK')
+
+            calSM['RightAnkleWidth'] = estimate(Rwidth,estimator,trim)
+            calSM['LeftAnkleWidth'] = estimate(Lwidth,estimator,trim)
 
     #calSM['RightKneeWidth'] = vsk['RightKneeWidth']
     #calSM['LeftKneeWidth'] = vsk['LeftKneeWidth']
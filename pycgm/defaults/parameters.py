@@ -1,25 +1,31 @@
 class Measurement():
     # a measurement name
     def __init__(self, name=None):
-        self.dataset_index = 0 # measurement = 0, marker = 1, axis = 2, angle = 3
+        self.dataset_index = 0 # measurement = 0, marker = 1, axis = 2, angle = 3, point = 4
         self.name  = name
 
 class Marker():
     # a marker name
     def __init__(self, name=None):
-        self.dataset_index = 1 # measurement = 0, marker = 1, axis = 2, angle = 3
+        self.dataset_index = 1 # measurement = 0, marker = 1, axis = 2, angle = 3, point = 4
         self.name  = name
     
 class Axis():
     # an axis name
     def __init__(self, name=None):
-        self.dataset_index = 2 # measurement = 0, marker = 1, axis = 2, angle = 3
+        self.dataset_index = 2 # measurement = 0, marker = 1, axis = 2, angle = 3, point = 4
         self.name  = name
 
 class Angle():
     # an angle name
     def __init__(self, name=None):
-        self.dataset_index = 3 # measurement = 0, marker = 1, axis = 2, angle = 3
+        self.dataset_index = 3 # measurement = 0, marker = 1, axis = 2, angle = 3, point = 4
+        self.name  = name
+
+class Point():
+    # a point name, e.g. a joint center stored as (frames, 3)
+    def __init__(self, name=None):
+        self.dataset_index = 4 # measurement = 0, marker = 1, axis = 2, angle = 3, point = 4
         self.name  = name
 
 class AxisFunctions():
@@ -44,8 +50,8 @@ class AxisFunctions():
 
             [
                 # hip_axis parameters
-                Axis('RHipJC'),
-                Axis('LHipJC'),
+                Point('RHipJC'),
+                Point('LHipJC'),
                 Axis('Pelvis')
             ],
 
@@ -53,7 +59,7 @@ class AxisFunctions():
                 # knee_axis parameters
                 Marker('RTHI'), Marker('LTHI'),
                 Marker('RKNE'), Marker('LKNE'),
-                Axis('RHipJC'), Axis('LHipJC'),
+                Point('RHipJC'), Point('LHipJC'),
                 Measurement('RightKneeWidth'),
                 Measurement('LeftKneeWidth')
             ],
@@ -104,7 +110,7 @@ class AxisFunctions():
             [
                 # clav_joint_center/shoulder_joint_center
                 Marker('RSHO'), Marker('LSHO'),
-                Axis('Thorax'), Axis('RWand'), Axis('LWand'),
+                Axis('Thorax'), Point('RWand'), Point('LWand'),
                 Measurement('RightShoulderOffset'),
                 Measurement('LeftShoulderOffset')
             ],
@@ -112,10 +118,10 @@ class AxisFunctions():
             [
                 # clav_axis/shoulder_axis parameters
                 Axis('Thorax'),
-                Axis('RClavJC'),
-                Axis('LClavJC'),
-                Axis('RWand'),
-                Axis('LWand')
+                Point('RClavJC'),
+                Point('LClavJC'),
+                Point('RWand'),
+                Point('LWand')
             ],
 
             [
@@ -134,7 +140,7 @@ class AxisFunctions():
             [
                 # rad_axis/wrist_axis parameters
                 Axis('RHum'),     Axis('LHum'),
-                Axis('RWristJC'), Axis('LWristJC')
+                Point('RWristJC'), Point('LWristJC')
             ],
 
             [
@@ -142,7 +148,7 @@ class AxisFunctions():
                 Marker('RWRA'),   Marker('RWRB'),
                 Marker('LWRA'),   Marker('LWRB'),
                 Marker('RFIN'),   Marker('LFIN'),
-                Axis('RWristJC'), Axis('LWristJC'),
+                Point('RWristJC'), Point('LWristJC'),
                 Measurement('RightHandThickness'),
                 Measurement('LeftHandThickness')
             ],
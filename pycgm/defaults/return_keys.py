@@ -17,6 +17,13 @@ def axes():
             'calc_axis_wrist': ['RRad', 'LRad'],
             'calc_axis_hand': ['RHand', 'LHand']}
 
+def points():
+    """
+    names of the returned axes that are points, stored as (frames, 3)
+    """
+    return ['RHipJC', 'LHipJC', 'RWand', 'LWand',
+            'RClavJC', 'LClavJC', 'RWristJC', 'LWristJC']
+
 def angles():
     """
     map function names to the angles they return
@@ -1,78 +1,207 @@
+import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import numpy.lib.recfunctions as rfn
 
-from ..defaults.parameters import Angle, Axis, Marker, Measurement
-from ..utils import subject_utils
+from ..defaults.parameters import Angle, Axis, Marker, Measurement, Point
+from ..utils import new_io, subject_utils
+from ..utils.trial import point_axis
 from .model_creator import ModelCreator
 
 
 class Model(ModelCreator):
-    def __init__(self, static_filename, dynamic_filenames, measurement_filename):
-        super().__init__(static_filename, dynamic_filenames, measurement_filename)
+    def __init__(self, static_filename, dynamic_filenames, measurement_filename, mmap=False, required_markers_only=False, analog=False,
+                 workers=None, cache_dir=None, static_estimator='mean', stance_window=None, calibration=None,
+                 dtype=np.float64):
+        super().__init__(static_filename, dynamic_filenames, measurement_filename, mmap=mmap,
+                         required_markers_only=required_markers_only, analog=analog, workers=workers,
+                         cache_dir=cache_dir, static_estimator=static_estimator, stance_window=stance_window,
+                         calibration=calibration, dtype=dtype)
 
 
-    def run(self):
+    def run(self, workers=None, axes=None, angles=None):
         """
         Run each trial in the model and insert output values into 
         the model's data struct.
+
+        Functions are dispatched through the model's execution plan, which
+        is compiled once and bound to each trial. Outputs are allocated when
+        a function first returns them. Only the functions needed for the
+        outputs declared with `keep_outputs`, or given here, are run, and
+        the other outputs are freed once no remaining function uses them.
+
+        Parameters
+        ----------
+        workers : int, optional
+            Number of threads to run functions that do not depend on each
+            other with, e.g. the lower and upper body segments, and the
+            angle functions once their axes exist. Functions run one at a
+            time by default. The outputs are the same either way.
+            No speedup has been measured yet: on a 60000 frame trial, 2, 4
+            and 8 workers ran no faster than one at a time. Time it with
+            speed_tests/benchmark_parallel_run.py on multi-core hardware.
+        axes, angles : list of str, optional
+            Names of the axes, or points, and angles to compute in this run,
+            in place of those declared with `keep_outputs`.
+
+        Examples
+        --------
+        Running only the lower limb angles, or running on threads, gives
+        the same angles as a full run.
+
+        >>> import contextlib, io, os
+        >>> import numpy as np
+        >>> from .model import Model
+        >>> files = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'SampleData', 'Test_Files'))
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model = Model(os.path.join(files, 'Static_trial.c3d'), [os.path.join(files, 'Movement_trial.c3d')],
+        ...                   os.path.join(files, 'Test.vsk'))
+        ...     model.run()
+        >>> trial = model.subject.dynamic['Movement_trial']
+        >>> full = {name: trial.angles[name].copy() for name in model.angle_keys}
+        >>> lower = ['RHip', 'LHip', 'RKnee', 'LKnee', 'RAnkle', 'LAnkle']
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model.run(angles=lower)
+        >>> sorted(trial.angles.arrays) == sorted(lower)
+        True
+        >>> all(np.array_equal(trial.angles[name], full[name], equal_nan=True) for name in lower)
+        True
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model.run(workers=2)
+        >>> all(np.array_equal(trial.angles[name], full[name], equal_nan=True) for name in full)
+        True
+        """
+
+        # The recarray copy of the subject is stale once outputs change
+        self.records = None
+
+        plan = self.execution_plan(axes, angles)
+
+        for trial_name in self.trial_names:
+            trial = self.subject.dynamic[trial_name]
+            tables = plan.bind(trial.marker, trial.axes, trial.angles, trial.points)
+
+            def report(step, seconds):
+                print(f"\t{trial_name:<20}\t{step.name:<25}\t{seconds:.5f}s")
+
+            if workers:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    plan.run(tables, pool, report)
+            else:
+                plan.run(tables, report=report)
+
+            for step in plan.steps:
+                self.dirty[trial_name].pop(step.name, None)
+
+
+    def update(self):
         """
+        Run again only the functions whose inputs changed since the last
+        run, over the frames that changed.
+
+        Functions are marked dirty by `edit_marker`, `add_markers`,
+        `modify_function` and `add_function`. Each dirty function runs with
+        every function that depends on it, over its dirty frames, and their
+        outputs are replaced over those frames only. Functions whose kept
+        outputs are missing, e.g. before the first run, run over every
+        frame, so an update gives the same outputs as `run`.
+
+        Examples
+        --------
+        After an edit, an update gives the same angles as a full run.
+
+        >>> import contextlib, io, os
+        >>> import numpy as np
+        >>> from .model import Model
+        >>> files = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'SampleData', 'Test_Files'))
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model = Model(os.path.join(files, 'Static_trial.c3d'), [os.path.join(files, 'Movement_trial.c3d')],
+        ...                   os.path.join(files, 'Test.vsk'))
+        ...     model.run()
+        >>> trial = model.subject.dynamic['Movement_trial']
+        >>> before = trial.angles['RHip'].copy()
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model.edit_marker('Movement_trial', 'RASI', slice(100, 120), trial.marker('RASI')[100:120] + 10)
+        ...     model.update()
+        >>> updated = {name: trial.angles[name].copy() for name in model.angle_keys}
+        >>> np.array_equal(updated['RHip'][:100], before[:100]), np.array_equal(updated['RHip'][100:120], before[100:120])
+        (True, False)
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model.run()
+        >>> all(np.array_equal(trial.angles[name], updated[name], equal_nan=True) for name in updated)
+        True
+        """
+
+        self.records = None
+
+        plan = self.execution_plan()
 
         for trial_name in self.trial_names:
-            for index, func in enumerate(self.axis_functions):
+            trial = self.subject.dynamic[trial_name]
+            dirty = self.dirty.setdefault(trial_name, {})
 
-                # Retrieve the names of the axes returned by this function
-                # e.g. 'calc_axis_pelvis' -> 'Pelvis'
-                returned_axis_names = self.axis_function_to_return[func.__name__]
+            def report(step, seconds):
+                print(f"\t{trial_name:<20}\t{step.name:<25}\t{seconds:.5f}s")
 
-                start = time.time()
+            plan.update(trial.marker, trial.axes, trial.angles, trial.points, dirty, trial.num_frames, report)
 
-                # Get the parameters for this function, run it
-                parameters = self.axis_func_parameters[trial_name][self.axis_execution_order[func.__name__]]
-                ret_axes = np.array(func(*parameters))
+            for step in plan.steps:
+                dirty.pop(step.name, None)
 
-                # Insert returned axes into the model structured array
-                if ret_axes.ndim == 4:
-                    # Multiple axes returned by one function
-                    for ret_axes_index, axis in enumerate(ret_axes):
-                        # Insert each axis into model
-                        self.data.dynamic[trial_name].axes[returned_axis_names[ret_axes_index]] = axis
 
-                else:
-                    # Insert returned axis into model
-                    self.data.dynamic[trial_name].axes[returned_axis_names[0]] = ret_axes
+    def run_stream(self, filename, sink, chunk_size=1000):
+        """Run a dynamic trial in fixed-size chunks of frames.
 
-                end = time.time()
+        The trial is not loaded into the model's data struct. Each chunk is read
+        from disk, passed through the axis and angle functions, and its output
+        is handed to `sink`, so memory use does not depend on the trial's length.
+
+        Parameters
+        ----------
+        filename : str
+            Filename of the dynamic trial .c3d
+        sink : callable
+            Called once per chunk as sink(trial_name, frames, axes, angles),
+            where frames is the slice of frames in the chunk and axes and angles
+            map output names to their values in the chunk,
+            e.g. new_io.CSVStreamWriter('RoboWalk.csv')
+        chunk_size : int, optional
+            Number of frames run at a time.
+
+        Notes
+        -----
+        Every axis and angle function operates on each frame independently,
+        so the output is the same as running the whole trial at once. Only
+        the functions needed for the outputs declared with `keep_outputs`
+        are run, and every output they return is handed to `sink`.
+        """
 
-                print(f"\t{trial_name:<20}\t{func.__name__:<25}\t{end-start:.5f}s")
+        trial_name = re.findall(r'[^\/]+(?=\.)', filename)[0]
 
-            for index, func in enumerate(self.angle_functions):
+        plan = self.execution_plan()
 
-                # Retrieve the names of the angles returned by this function
-                # e.g. 'calc_angle_pelvis' -> 'Pelvis'
-                returned_angle_names = self.angle_function_to_return[func.__name__]
+        for frames, markers in new_io.iter_c3d_chunks(filename, chunk_size, markers=self.required_marker_names()):
+            start = time.time()
 
-                start = time.time()
+            axes   = {}
+            points = {}
+            angles = {}
 
-                # Get the parameters for this function, run it
-                parameters = self.angle_func_parameters[trial_name][self.angle_execution_order[func.__name__]]
-                ret_angles = np.array(func(*parameters))
+            tables = plan.bind(markers.get, axes, angles, points)
+            for step in plan.steps:
+                plan.execute(step, tables, free=False)
 
-                # Insert returned angles into the model structured array
-                if ret_angles.ndim == 3:
-                    # Multiple angles returned by one function
-                    for ret_angles_index, angle in enumerate(ret_angles):
-                        # Insert each angle into model
-                        self.data.dynamic[trial_name].angles[returned_angle_names[ret_angles_index]] = angle
+            # Sinks are handed points in the layout of axes, in the order they were returned
+            sink_axes = {name: axes[name] if name in axes else point_axis(points[name])
+                         for name in self.axis_keys if name in axes or name in points}
 
-                else:
-                    # Insert returned angle into model
-                    self.data.dynamic[trial_name].angles[returned_angle_names[0]] = ret_angles
+            sink(trial_name, frames, sink_axes, angles)
 
-                end = time.time()
+            end = time.time()
 
-                print(f"\t{trial_name:<20}\t{func.__name__:<25}\t{end-start:.5f}s")
+            print(f"\t{trial_name:<20}\tframes {frames.start}-{frames.stop:<14}\t{end-start:.5f}s")
 
 
     def get_markers(self, arr, names, points_only=True, debug=False):
@@ -80,6 +209,11 @@ class Model(ModelCreator):
 
         if isinstance(names, str):
             names = [names]
+
+        if arr.dtype == object:
+            # Memory-mapped trial, decode only the requested markers
+            return arr[0].get(names, points_only)
+
         num_frames = arr[0][0].shape[0]
 
         if any(name not in arr[0].dtype.names for name in names):
@@ -100,7 +234,8 @@ class Model(ModelCreator):
         return rec
 
 
-    def modify_function(self, function, markers=None, measurements=None, axes=None, angles=None, returns_axes=None, returns_angles=None):
+    def modify_function(self, function, markers=None, measurements=None, axes=None, angles=None, returns_axes=None, returns_angles=None,
+                        points=None, returns_points=None):
         """Modify an existing function's parameters and returned values
 
         Parameters
@@ -119,6 +254,11 @@ class Model(ModelCreator):
             Name(s) of returned axes.
         returns_angles : list of str, optional
             Name(s) of returned angles.
+        points : list of str, optional
+            Name(s) of required point parameters, e.g. joint centers.
+        returns_points : list of str, optional
+            Name(s) of returned points, stored as (frames, 3). Returned after
+            any `returns_axes`.
 
         Raises
         ------
@@ -127,6 +267,11 @@ class Model(ModelCreator):
             If function is not of type str
         """
 
+        if returns_points is not None:
+            # Points are returned axes that are stored as (frames, 3)
+            returns_axes = (returns_axes or []) + list(returns_points)
+            self.point_keys.extend(name for name in returns_points if name not in self.point_keys)
+
         if returns_axes is not None and returns_angles is not None:
             raise Exception(f'{function} must return either an axis or an angle, not both')
 
@@ -141,6 +286,9 @@ class Model(ModelCreator):
         for axis_name in [axis_name for axis_name in (axes or [])]:
             params.append(Axis(axis_name))
 
+        for point_name in [point_name for point_name in (points or [])]:
+            params.append(Point(point_name))
+
         for angle_name in [angle_name for angle_name in (angles or [])]:
             params.append(Angle(angle_name))
 
@@ -157,6 +305,9 @@ class Model(ModelCreator):
         else:
             raise Exception(f'Pass the name of the function as a string like so: \'{function.__name__}\'')
 
+        # The plan is stale once a function's parameters change
+        self.plan = None
+
         if returns_axes is not None:
             # Add returned axes, update related attributes
             self.axis_function_to_return[function] = returns_axes
@@ -165,11 +316,19 @@ class Model(ModelCreator):
             # Add returned angles, update related attributes
             self.angle_function_to_return[function] = returns_angles
 
-        # Expand required parameter names to their values in each trial's dataset
-        self.axis_func_parameters, self.angle_func_parameters = self.update_trial_parameters()
+        # Load only the markers the function needs that were not loaded
+        self.load_missing_markers(markers or [])
 
+        if returns_axes is not None or returns_angles is not None:
+            # Declare the returned outputs in the loaded trials
+            self.update_schema()
 
-    def add_function(self, function, order=None, measurements=None, markers=None, axes=None, angles=None, returns_axes=None, returns_angles=None):
+        for trial_name in self.trial_names:
+            self.mark_dirty(trial_name, [function])
+
+
+    def add_function(self, function, order=None, measurements=None, markers=None, axes=None, angles=None, returns_axes=None, returns_angles=None,
+                     points=None, returns_points=None):
         """Add a custom function to the model.
 
         Parameters
@@ -178,6 +337,8 @@ class Model(ModelCreator):
             Name or function object that is to be added.
         order : list or tuple of [str, int], optional
             Index in the execution order the function is to be run, represented as [function_name, offset].
+            Not needed for the function to run after the functions whose outputs it uses,
+            see Notes. Appended to the execution order by default.
         measurements : list of str, optional
             Name(s) of required measurement parameters.
         markers : list of str, optional
@@ -190,6 +351,11 @@ class Model(ModelCreator):
             Name(s) of returned axes.
         returns_angles : list of str, optional
             Name(s) of returned angles.
+        points : list of str, optional
+            Name(s) of required point parameters, e.g. joint centers.
+        returns_points : list of str, optional
+            Name(s) of returned points, stored as (frames, 3). Returned after
+            any `returns_axes`.
 
         Raises
         ------
@@ -201,6 +367,12 @@ class Model(ModelCreator):
         
         Notes
         -----
+        Functions are scheduled from their parameters and returns, see ModelCreator.schedule.
+        A function always runs after the functions that return its axis, point and angle
+        parameters, and before the functions that use its returns, wherever it is in the
+        execution order. The execution order only decides between functions that do not
+        depend on each other.
+
         order is represented by [function_name, offset]
             - function_name is the name of the function that the new function will be run relative to.
             - offset is offset from the target function_name that the new function will be run.
@@ -244,23 +416,9 @@ class Model(ModelCreator):
             self.axis_functions.insert(target_index, func)
             self.axis_execution_order, self.angle_execution_order = self.map_function_names_to_index()
 
-            # Extend the returned axes of the function BEFORE the new function
-            # e.g. calc_joint_center_hip returns [RHipJC, LHipJC]
-            #      We don't want to position the returned axes between RHipJC and LHipJC,
-            #      so calc_joint_center_hip's returned axes must be extended
-            function_to_extend = self.axis_functions[target_index - 1].__name__
-            self.axis_function_to_return[function_to_extend].extend(returns_axes)
-
-            # Update return keys 
-            self.axis_keys, self.angle_keys = self.update_return_keys()           
-
             # Insert the function's parameters into the target index
             self.axis_func_parameter_names.insert(self.axis_execution_order[func_name], params)
 
-            # Add empty space for custom function's parameters in each trial
-            for trial_name in self.trial_names:
-                self.axis_func_parameters[trial_name].insert(target_index+1, [])
-
 
         def insert_angle_function(target_function_name, offset, func):
             """Insert a custom angle function at the desired offset from a target function name.
@@ -297,25 +455,11 @@ class Model(ModelCreator):
 
             # Insert at specified index and update execution order
             self.angle_functions.insert(target_index, func)
-            self.angle_execution_order, self.angle_execution_order = self.map_function_names_to_index()
-
-            # Extend the returned angles of the function BEFORE the new function
-            # e.g. calc_joint_center_hip returns [RHipJC, LHipJC]
-            #      We don't want to position the returned angles between RHipJC and LHipJC,
-            #      so calc_joint_center_hip's returned angles must be extended
-            function_to_extend = self.angle_functions[target_index - 1].__name__
-            self.angle_function_to_return[function_to_extend].extend(returns_angles)
-
-            # Update return keys 
-            self.angle_keys, self.angle_keys = self.update_return_keys()           
+            self.axis_execution_order, self.angle_execution_order = self.map_function_names_to_index()
 
             # Insert the function's parameters into the target index
             self.angle_func_parameter_names.insert(self.angle_execution_order[func_name], params)
 
-            # Add empty space for custom function's parameters in each trial
-            for trial_name in self.trial_names:
-                self.angle_func_parameters[trial_name].insert(target_index+1, [])
-
 
         # Get func object and name
         if isinstance(function, str):
@@ -325,6 +469,11 @@ class Model(ModelCreator):
             func_name = function.__name__
             func      = function
 
+        if returns_points is not None:
+            # Points are returned axes that are stored as (frames, 3)
+            returns_axes = (returns_axes or []) + list(returns_points)
+            self.point_keys.extend(name for name in returns_points if name not in self.point_keys)
+
         if returns_axes is not None and returns_angles is not None:
             raise Exception(f'{func_name} must return either an axis or an angle, not both')
         if returns_axes is None and returns_angles is None:
@@ -341,6 +490,9 @@ class Model(ModelCreator):
         for axis_name in [axis_name for axis_name in (axes or [])]:
             params.append(Axis(axis_name))
 
+        for point_name in [point_name for point_name in (points or [])]:
+            params.append(Point(point_name))
+
         for angle_name in [angle_name for angle_name in (angles or [])]:
             params.append(Angle(angle_name))
 
@@ -364,14 +516,12 @@ class Model(ModelCreator):
             else:
                 # Append to the end
                 self.axis_functions.append(func)
-                self.axis_keys.extend(returns_axes)
-
-                for trial_name in self.trial_names:
-                    self.axis_func_parameters[trial_name].append([])
+                self.axis_func_parameter_names.append(params)
+                self.axis_execution_order, self.angle_execution_order = self.map_function_names_to_index()
 
             # Update parameters and returns
-            self.axis_func_parameter_names[self.axis_execution_order[function]] = params
-            self.axis_function_to_return[function] = returns_axes
+            self.axis_func_parameter_names[self.axis_execution_order[func_name]] = params
+            self.axis_function_to_return[func_name] = returns_axes
 
         if returns_angles is not None:
             # Add returned angles, update related attributes
@@ -392,18 +542,18 @@ class Model(ModelCreator):
             else:
                 # Append to the end
                 self.angle_functions.append(func)
-                self.angle_keys.extend(returns_angles)
-
-                for trial_name in self.trial_names:
-                    self.angle_func_parameters[trial_name].append([])
+                self.angle_func_parameter_names.append(params)
+                self.axis_execution_order, self.angle_execution_order = self.map_function_names_to_index()
 
             # Update parameters and returns
-            self.angle_func_parameter_names[self.angle_execution_order[function]] = params
-            self.angle_function_to_return[function] = returns_angles
+            self.angle_func_parameter_names[self.angle_execution_order[func_name]] = params
+            self.angle_function_to_return[func_name] = returns_angles
 
-        # Remake data struct with new return keys
-        self.data = self.make_data_struct()
+        # Load only the markers the function needs that were not loaded,
+        # and declare its outputs in the loaded trials
+        self.load_missing_markers(markers or [])
+        self.update_schema()
 
-        # Expand required parameter names to their values in each trial's dataset
-        self.axis_func_parameters, self.angle_func_parameters = self.update_trial_parameters()
+        for trial_name in self.trial_names:
+            self.mark_dirty(trial_name, [func_name])
 
@@ -1,3 +1,4 @@
+import heapq
 from itertools import chain
 
 import numpy as np
@@ -5,15 +6,27 @@ import numpy as np
 from ..calc.dynamic import CalcAngles, CalcAxes
 from ..defaults import return_keys
 from ..defaults.parameters import (Angle, AngleFunctions, Axis, AxisFunctions,
-                                   Marker, Measurement)
+                                   Marker, Point)
 from ..utils import subject_utils
+from ..utils.trial import load_markers
+from .plan import ExecutionPlan
 
 
 class ModelCreator():
-    def __init__(self, static_filename, dynamic_filenames, measurement_filename):
+    def __init__(self, static_filename, dynamic_filenames, measurement_filename, mmap=False, required_markers_only=False, analog=False, workers=None, cache_dir=None,
+                 static_estimator='mean', stance_window=None, calibration=None, dtype=np.float64):
         self.static_filename = static_filename
         self.dynamic_filenames = dynamic_filenames
         self.measurement_filename = measurement_filename
+        self.mmap = mmap
+        self.required_markers_only = required_markers_only
+        self.analog = analog
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.static_estimator = static_estimator
+        self.stance_window = stance_window
+        self.calibration = calibration
+        self.dtype = dtype
 
         # Add non-overridden default dynamic funcs to funcs list
         self.axis_functions  = self.get_axis_functions()
@@ -31,23 +44,157 @@ class ModelCreator():
         #   self.angle_keys: ['Pelvis','RHip',   'LHip',   'RKnee', 'LKnee',  ...]
         self.axis_keys, self.angle_keys = self.update_return_keys()           
 
-        # Structure subject data
-        self.data = self.make_data_struct()
-        self.trial_names = self.data.dynamic.dtype.names
+        # Returned axes that are stored as (frames, 3) points, e.g. joint centers
+        #   self.point_keys: ['RHipJC', 'LHipJC', 'RWand', 'LWand', ...]
+        self.point_keys = return_keys.points()
 
         # Get default parameter objects
         self.axis_func_parameter_names  = AxisFunctions().parameters()
         self.angle_func_parameter_names = AngleFunctions().parameters()
 
-        # Expand required parameter names to their values in each trial's dataset
-        self.axis_func_parameters, self.angle_func_parameters = self.update_trial_parameters()
+        # Load subject data into columnar trials
+        self.subject = self.load_subject()
+        self.trial_names = list(self.subject.dynamic)
 
-    def make_data_struct(self):
-        return subject_utils.structure_model(self.static_filename,
+        # Names of the outputs kept after a run, all of them by default
+        self.kept_axes  = None
+        self.kept_angles = None
+
+        # Compiled on first run, and again after the functions or outputs change
+        self.plan = None
+
+        # Frames of each function to run again in each trial, see mark_dirty
+        self.dirty = {trial_name: {} for trial_name in self.trial_names}
+
+    @property
+    def data(self):
+        """The subject's data in a single nested recarray.
+
+        A copy of `self.subject`, made on first access after the subject is
+        loaded or the model is run. Kept for compatibility, `self.subject`
+        is the model's working data.
+        """
+        if self.records is None:
+            self.records = self.subject.records()
+
+        return self.records
+
+    def load_subject(self):
+        # Only load the markers that the model's functions use
+        self.loaded_markers = self.required_marker_names() if self.required_markers_only else None
+
+        # The recarray copy and the plan's measurements are stale once the subject is reloaded
+        self.records = None
+        self.plan = None
+
+        return subject_utils.load_subject(self.static_filename,
                                              self.dynamic_filenames,
                                              self.measurement_filename,
                                              self.axis_keys,
-                                             self.angle_keys)
+                                             self.angle_keys,
+                                             mmap=self.mmap,
+                                             markers=self.loaded_markers,
+                                             analog=self.analog,
+                                             workers=self.workers,
+                                             cache_dir=self.cache_dir,
+                                             static_estimator=self.static_estimator,
+                                             stance_window=self.stance_window,
+                                             calibration=self.calibration,
+                                             dtype=self.dtype,
+                                             point_result_keys=self.point_keys)
+
+    def add_markers(self, trial_name, markers):
+        """Add virtual markers to a dynamic trial, e.g. for a custom function to use.
+
+        Parameters
+        ----------
+        trial_name : str
+            Name of the dynamic trial, e.g. 'RoboWalk'
+        markers : dict
+            Maps the name of each new marker to its (frames, 3) positions.
+
+        See trial.Trial.add_markers
+        """
+        self.subject.dynamic[trial_name].add_markers(markers)
+
+        # The recarray copy is stale once the markers change
+        self.records = None
+        self.mark_dirty(trial_name, self.marker_functions(markers))
+
+    def edit_marker(self, trial_name, name, frames, positions):
+        """Overwrite the positions of a marker over some frames of a dynamic trial.
+
+        The functions that use the marker are marked dirty over those
+        frames, so `update` only runs them, and the functions that depend
+        on them, over the edited frames.
+
+        Parameters
+        ----------
+        trial_name : str
+            Name of the dynamic trial, e.g. 'RoboWalk'
+        name : str
+            Name of the marker, e.g. 'RASI'
+        frames : slice or array of int
+            Frames to overwrite, e.g. slice(100, 120).
+        positions : ndarray
+            The (frames, 3) positions of the marker over `frames`.
+
+        See trial.Trial.edit_marker
+
+        Examples
+        --------
+        >>> model.edit_marker('RoboWalk', 'RASI', slice(100, 120), fixed_positions) #doctest: +SKIP
+        >>> model.update() #doctest: +SKIP
+        """
+        self.subject.dynamic[trial_name].edit_marker(name, frames, positions)
+
+        self.records = None
+        self.mark_dirty(trial_name, self.marker_functions([name]), frames)
+
+    def mark_dirty(self, trial_name, function_names, frames=None):
+        """Mark functions to be run again over some frames of a trial by `update`.
+
+        Parameters
+        ----------
+        trial_name : str
+            Name of the dynamic trial, e.g. 'RoboWalk'
+        function_names : list of str
+            Names of the functions whose inputs changed. The functions that
+            depend on them are found when `update` runs.
+        frames : slice or array of int, optional
+            Frames whose inputs changed. Every frame by default.
+        """
+        num_frames = self.subject.dynamic[trial_name].num_frames
+        dirty = self.dirty.setdefault(trial_name, {})
+
+        for name in function_names:
+            mask = dirty.setdefault(name, np.zeros(num_frames, dtype=bool))
+            mask[slice(None) if frames is None else frames] = True
+
+    def marker_functions(self, marker_names):
+        """Get the names of the functions that take any of the markers as a parameter."""
+        functions = chain(zip(self.axis_functions, self.axis_func_parameter_names),
+                          zip(self.angle_functions, self.angle_func_parameter_names))
+
+        return [function.__name__ for function, parameters in functions
+                if any(isinstance(parameter, Marker) and parameter.name in marker_names for parameter in parameters)]
+
+    def required_marker_names(self):
+        """Get the names of all markers used by the model's functions.
+
+        Returns
+        -------
+        marker_names : list of str
+            Union of the Marker parameters of every axis and angle function,
+            in order of first use.
+        """
+        marker_names = {}
+        for function_parameters in chain(self.axis_func_parameter_names, self.angle_func_parameter_names):
+            for parameter in function_parameters:
+                if isinstance(parameter, Marker):
+                    marker_names[parameter.name] = None
+
+        return list(marker_names)
 
     def get_axis_functions(self):
         """
@@ -131,88 +278,380 @@ class ModelCreator():
 
 
     def update_return_keys(self):
-        axis_keys = list(chain.from_iterable(self.axis_function_to_return.values()))
-        angle_keys = list(chain.from_iterable(self.angle_function_to_return.values()))
+        # Returned names in execution order. A name returned by more than
+        # one function is listed once, in its first position
+        axis_keys = list(dict.fromkeys(chain.from_iterable(self.axis_function_to_return[func.__name__] for func in self.axis_functions)))
+        angle_keys = list(dict.fromkeys(chain.from_iterable(self.angle_function_to_return[func.__name__] for func in self.angle_functions)))
 
         return axis_keys, angle_keys
 
 
-    def names_to_values(self, function_parameters, trial_name):
-        """Convert a list of function parameter objects to their values in each trial's dataset
+    def update_schema(self):
+        """Update the outputs of the loaded trials after functions are added or modified.
+
+        New outputs are declared in place, without reloading any files.
+        """
+        self.axis_keys, self.angle_keys = self.update_return_keys()
+
+        for trial in self.subject.dynamic.values():
+            trial.declare(self.axis_keys, self.angle_keys, self.point_keys)
+
+        # The recarray copy and the plan are stale once the outputs change
+        self.records = None
+        self.plan = None
+
+
+    def load_missing_markers(self, marker_names):
+        """Load markers that were left out by `required_markers_only`, e.g. for a new function.
+
+        Only the missing markers are read from the dynamic trials, and
+        appended to their loaded markers.
+        """
+        if self.loaded_markers is None:
+            return
+
+        missing = [name for name in dict.fromkeys(marker_names) if name not in self.loaded_markers]
+        if not missing:
+            return
+
+        self.loaded_markers += missing
+
+        dynamic_filenames = [self.dynamic_filenames] if isinstance(self.dynamic_filenames, str) else self.dynamic_filenames
+        for filename, trial in zip(dynamic_filenames, self.subject.dynamic.values()):
+            markers, _, _ = load_markers(filename, markers=missing, mmap=self.mmap, dtype=self.dtype)
+            trial.add_markers({name: markers[name] for name in markers.names if name not in trial.markers})
+
+        self.records = None
+
+
+    def keep_outputs(self, axes=None, angles=None):
+        """Declare the outputs to keep after a run.
+
+        Only the functions the kept outputs depend on are run. Every other
+        output is freed as soon as the last function that uses it has run,
+        so a trial only holds the intermediate outputs that are still
+        needed. By default every output is kept.
 
         Parameters
         ----------
-        function_parameters : list of lists of parameter objects
-            Required parameter objects for all functions
-        trial_name : str
-            The name of the trial
-        
+        axes : list of str, optional
+            Names of the axes, or points, to keep. No axes are kept if only
+            `angles` is given.
+        angles : list of str, optional
+            Names of the angles to keep. No angles are kept if only `axes` is given.
+
+        Examples
+        --------
+        >>> model.keep_outputs(angles=['RHip', 'LHip', 'RKnee', 'LKnee']) #doctest: +SKIP
+        >>> model.run() #doctest: +SKIP
+        """
+        if axes is None and angles is None:
+            self.kept_axes, self.kept_angles = None, None
+        else:
+            self.kept_axes, self.kept_angles = list(axes or []), list(angles or [])
+
+        self.plan = None
+
+
+    def execution_plan(self, axes=None, angles=None):
+        """Get the model's execution plan, compiling it if the model changed since it was last compiled.
+
+        Parameters
+        ----------
+        axes, angles : list of str, optional
+            Outputs to compute, overriding those declared with `keep_outputs`.
+            A plan for given outputs is compiled on every call.
+
         Returns
         -------
-        updated_parameters_list : list of list of ndarray
-            The values of all specified parameters of all functions of the given trial
-
-        Notes
-        -----
-        function_parameters is a list of lists of parameter objects like so:
-            [
-                [
-                    # knee_axis parameters
-                    Marker('RTHI'),
-                    Marker('LTHI'),
-                    Marker('RKNE'),
-                    Marker('LKNE'),
-                    Axis('RHipJC'),
-                    Axis('LHipJC'),
-                    Measurement('RightKneeWidth'),
-                    Measurement('LeftKneeWidth')
-                ],
-                ...other functions
-            ]
-        """
-
-        updated_parameters_list = [[] for _ in range(len(function_parameters))]
-
-        for function_index, function_parameters in enumerate(function_parameters):
-            for parameter in function_parameters:
+        plan : plan.ExecutionPlan
+        """
+        if axes is not None or angles is not None:
+            return ExecutionPlan.compile(self, self.selected_outputs(axes, angles))
 
-                if isinstance(parameter, Marker):
-                    # Use marker name to retrieve from marker struct
-                    new_parameter = self.get_markers(self.data.dynamic[trial_name].markers, parameter.name, True)
-                    if new_parameter is not None:
-                        new_parameter = new_parameter[0]
-                    updated_parameters_list[function_index].append(new_parameter)
+        if self.plan is None:
+            self.plan = ExecutionPlan.compile(self, self.selected_outputs())
+
+        return self.plan
+
+
+    def selected_outputs(self, axes=None, angles=None):
+        """Get the (kind, name) of the outputs to keep after a run.
+
+        Parameters
+        ----------
+        axes, angles : list of str, optional
+            Names of the axes, or points, and angles to keep. Those declared
+            with `keep_outputs` are used if neither is given.
+
+        Returns
+        -------
+        outputs : set of tuple or None
+            (kind, name) of each output, kind being 'axes', 'points' or
+            'angles'. None if every output is kept.
+        """
+        if axes is None and angles is None:
+            axes, angles = self.kept_axes, self.kept_angles
+
+            if axes is None and angles is None:
+                return None
+
+        return {(self.axis_kind(name), name) for name in axes or []} | {('angles', name) for name in angles or []}
+
+
+    def output_lifetimes(self, outputs=None):
+        """Find the outputs that can be freed after each function has run.
+
+        Parameters
+        ----------
+        outputs : set of tuple, optional
+            (kind, name) of the outputs to keep, see `selected_outputs`.
+            Every output is kept by default.
+
+        Returns
+        -------
+        free_after : dict
+            Maps ('axis', index) or ('angle', index) of a function to the
+            (kind, name) of each output that is neither kept nor used by a
+            function scheduled after it. kind is 'axes', 'points' or 'angles'.
+
+        Examples
+        --------
+        The pelvis axis is freed once the hip joint centers are computed:
+
+        >>> import contextlib, io, os
+        >>> from .model import Model
+        >>> files = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'SampleData', 'Test_Files'))
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model = Model(os.path.join(files, 'Static_trial.c3d'), [os.path.join(files, 'Movement_trial.c3d')],
+        ...                   os.path.join(files, 'Test.vsk'))
+        >>> free_after = model.output_lifetimes({('angles', 'RKnee')})
+        >>> [(model.function_name(step), outputs) for step, outputs in free_after.items()][0]
+        ('calc_joint_center_hip', [('axes', 'Pelvis')])
+        """
+        if outputs is None:
+            return {}
+
+        # The last function that uses each output, or the one that returns it if none does
+        last_use = {}
+        for step in self.schedule(outputs):
+            for output in self.function_inputs(step):
+                last_use[output] = step
+
+            for output in self.function_outputs(step):
+                last_use[output] = step
+
+        free_after = {}
+        for output, step in last_use.items():
+            if output not in outputs:
+                free_after.setdefault(step, []).append(output)
+
+        return free_after
+
+
+    def function_inputs(self, step):
+        """Get the (kind, name) of the outputs a function uses, given its ('axis' or 'angle', index)."""
+        kind, index = step
+        parameter_names = self.axis_func_parameter_names if kind == 'axis' else self.angle_func_parameter_names
+
+        inputs = []
+        for parameter in parameter_names[index]:
+            if isinstance(parameter, (Axis, Point)):
+                inputs.append((self.axis_kind(parameter.name), parameter.name))
+            elif isinstance(parameter, Angle):
+                inputs.append(('angles', parameter.name))
+
+        return inputs
+
+
+    def function_outputs(self, step):
+        """Get the (kind, name) of the outputs a function returns, given its ('axis' or 'angle', index)."""
+        kind, index = step
+        if kind == 'axis':
+            return [(self.axis_kind(name), name) for name in self.axis_function_to_return[self.axis_functions[index].__name__]]
+
+        return [('angles', name) for name in self.angle_function_to_return[self.angle_functions[index].__name__]]
+
+
+    def function_graph(self):
+        """Build the dependency graph of the model's functions from their parameters and returns.
+
+        A function depends on the functions that return the axes, points
+        and angles it takes as parameters. If more than one function
+        returns an output, the last one in the execution order is used.
+
+        Returns
+        -------
+        steps : list of tuple
+            ('axis', index) or ('angle', index) of every function, axis
+            functions first, each in execution order.
+        dependencies : dict
+            Maps each step to the set of steps it depends on.
+        """
+        steps  = [('axis', index) for index in range(len(self.axis_functions))]
+        steps += [('angle', index) for index in range(len(self.angle_functions))]
+
+        producers = self.output_producers(steps)
+
+        dependencies = {}
+        for step in steps:
+            dependencies[step] = {producers[output] for output in self.function_inputs(step)
+                                  if output in producers and producers[output] != step}
+
+        return steps, dependencies
+
+
+    def output_producers(self, steps):
+        """Map the (kind, name) of each output to the last of `steps` that returns it."""
+        producers = {}
+        for step in steps:
+            for output in self.function_outputs(step):
+                producers[output] = step
+
+        return producers
+
+
+    def required_functions(self, outputs):
+        """Find the functions needed to compute some outputs.
+
+        Walks the dependency graph back from the functions that return the
+        outputs, so e.g. the lower limb angles only need the pelvis, hip,
+        knee and ankle functions.
+
+        Parameters
+        ----------
+        outputs : set of tuple
+            (kind, name) of the outputs, see `selected_outputs`.
+
+        Returns
+        -------
+        steps : list of tuple
+            ('axis', index) or ('angle', index) of the needed functions,
+            in execution order.
+
+        Raises
+        ------
+        ValueError
+            If no function returns one of the outputs.
+
+        Examples
+        --------
+        >>> import contextlib, io, os
+        >>> from .model import Model
+        >>> files = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'SampleData', 'Test_Files'))
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model = Model(os.path.join(files, 'Static_trial.c3d'), [os.path.join(files, 'Movement_trial.c3d')],
+        ...                   os.path.join(files, 'Test.vsk'))
+        >>> [model.function_name(step) for step in model.required_functions({('angles', 'RKnee')})]
+        ['calc_axis_pelvis', 'calc_joint_center_hip', 'calc_axis_knee', 'calc_axis_ankle', 'calc_angle_knee']
+        >>> model.required_functions({('angles', 'RKneeFlexion')})
+        Traceback (most recent call last):
+            ...
+        ValueError: No function returns ['RKneeFlexion']
+        """
+        steps, dependencies = self.function_graph()
+        producers = self.output_producers(steps)
+
+        missing = sorted(name for output_kind, name in outputs if (output_kind, name) not in producers)
+        if missing:
+            raise ValueError(f'No function returns {missing}')
+
+        required = set()
+        pending = [producers[output] for output in outputs]
+        while pending:
+            step = pending.pop()
+            if step not in required:
+                required.add(step)
+                pending.extend(dependencies[step])
+
+        return [step for step in steps if step in required]
+
+
+    def schedule(self, outputs=None):
+        """Order the model's functions so that each runs after the functions it depends on.
+
+        Functions that do not depend on each other keep their execution
+        order, so custom functions can be added without an `order`.
+
+        Parameters
+        ----------
+        outputs : set of tuple, optional
+            (kind, name) of the outputs to compute, see `selected_outputs`.
+            Only the functions they need are scheduled. Every function is
+            scheduled by default.
+
+        Returns
+        -------
+        schedule : list of tuple
+            ('axis', index) or ('angle', index) of every scheduled function,
+            in the order they are run.
+
+        Raises
+        ------
+        ValueError
+            If the dependencies between functions form a cycle, or no
+            function returns one of the outputs.
+
+        Examples
+        --------
+        >>> import contextlib, io, os
+        >>> from .model import Model
+        >>> files = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'SampleData', 'Test_Files'))
+        >>> with contextlib.redirect_stdout(io.StringIO()):
+        ...     model = Model(os.path.join(files, 'Static_trial.c3d'), [os.path.join(files, 'Movement_trial.c3d')],
+        ...                   os.path.join(files, 'Test.vsk'))
+        >>> [model.function_name(step) for step in model.schedule()][:4]
+        ['calc_axis_pelvis', 'calc_joint_center_hip', 'calc_axis_hip', 'calc_axis_knee']
+
+        A pelvis that depends on the hip axis, which depends on the pelvis,
+        cannot be scheduled:
+
+        >>> model.modify_function('calc_axis_pelvis', axes=['Hip'])
+        >>> model.schedule() #doctest: +ELLIPSIS
+        Traceback (most recent call last):
+            ...
+        ValueError: Functions ['calc_axis_pelvis', 'calc_joint_center_hip', 'calc_axis_hip', ...] cannot be scheduled, their dependencies form a cycle
+        """
+        steps, dependencies = self.function_graph()
+        if outputs is not None:
+            steps = self.required_functions(outputs)
+
+        position = {step: i for i, step in enumerate(steps)}
 
-                elif isinstance(parameter, Measurement):
-                    # Use measurement name to retrieve from measurements struct
-                    try:
-                        new_parameter = self.data.static.measurements[parameter.name][0]
-                    except ValueError:
-                        new_parameter = None
+        dependents = {step: [] for step in steps}
+        remaining = {}
+        for step in steps:
+            remaining[step] = len(dependencies[step])
+            for dependency in dependencies[step]:
+                dependents[dependency].append(step)
 
-                    updated_parameters_list[function_index].append(new_parameter)
+        # Kahn's algorithm, taking the earliest ready function in execution order first
+        ready = [position[step] for step in steps if remaining[step] == 0]
+        heapq.heapify(ready)
 
-                elif isinstance(parameter, Axis):
-                    # Add parameter from axes struct
-                    updated_parameters_list[function_index].append(self.data.dynamic[trial_name].axes[parameter.name][0])
+        schedule = []
+        while ready:
+            step = steps[heapq.heappop(ready)]
+            schedule.append(step)
 
-                elif isinstance(parameter, Angle):
-                    # Add parameter from angles struct
-                    updated_parameters_list[function_index].append(self.data.dynamic[trial_name].angles[parameter.name])
+            for dependent in dependents[step]:
+                remaining[dependent] -= 1
+                if remaining[dependent] == 0:
+                    heapq.heappush(ready, position[dependent])
 
-                else:
-                    # Parameter is a constant, append as is
-                    updated_parameters_list[function_index].append(parameter)
+        if len(schedule) < len(steps):
+            blocked = [self.function_name(step) for step in steps if remaining[step] > 0]
+            raise ValueError(f'Functions {blocked} cannot be scheduled, their dependencies form a cycle')
 
-        return updated_parameters_list
+        return schedule
 
 
-    def update_trial_parameters(self):
-        axis_func_parameters  = {}
-        angle_func_parameters = {}
-        for trial in self.trial_names:
-            axis_func_parameters[trial]  = self.names_to_values(self.axis_func_parameter_names,  trial)
-            angle_func_parameters[trial] = self.names_to_values(self.angle_func_parameter_names, trial)
+    def function_name(self, step):
+        kind, index = step
+        functions = self.axis_functions if kind == 'axis' else self.angle_functions
+        return functions[index].__name__
 
-        return axis_func_parameters, angle_func_parameters
 
+    def axis_kind(self, name):
+        """Get the outputs a returned axis is stored in, 'points' or 'axes'."""
+        return 'points' if name in self.point_keys else 'axes'
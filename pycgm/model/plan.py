@@ -0,0 +1,524 @@
+"""
+Execution plan of a model.
+
+A model's functions and their parameter objects are compiled once per
+schema into a flat list of steps, scheduled from the dependencies between
+the functions. Each parameter is resolved to a slot, the table it is read
+from, and its key in that table, so running a trial only binds the trial's
+tables and looks the values up, without walking the parameter objects
+again.
+"""
+
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import numpy as np
+
+from ..defaults.parameters import Angle, Axis, Marker, Measurement, Point
+from ..utils.trial import point_axis
+
+# Slots of the tables a plan is bound to. The first five are the
+# dataset_index of the parameter objects read from them.
+MEASUREMENTS = 0
+MARKERS      = 1
+AXES         = 2
+ANGLES       = 3
+POINTS       = 4
+POINT_AXES   = 5  # points passed to an Axis parameter, laid out as axes
+
+# Slot of each kind of output in Trial.free and ModelCreator.output_lifetimes
+OUTPUT_SLOTS = {'axes': AXES, 'angles': ANGLES, 'points': POINTS}
+
+
+class MarkerTable():
+    """Markers of a trial, looked up by a callable that returns None for missing markers."""
+
+    def __init__(self, marker):
+        self.marker = marker
+
+    def __getitem__(self, name):
+        return self.marker(name)
+
+
+class PointAxisTable():
+    """Points of a trial, laid out as axes whose x, y and z axes are zeros."""
+
+    def __init__(self, points):
+        self.points = points
+
+    def __getitem__(self, name):
+        return point_axis(self.points[name])
+
+
+class FrameTable():
+    """Outputs of a trial over some of its frames.
+
+    Values written replace the outputs over those frames only. Outputs
+    that were freed are allocated again, as zeros, when first written.
+    Outputs must be trial.Outputs, for their `allocate`.
+    """
+
+    def __init__(self, outputs, frames):
+        self.outputs = outputs
+        self.frames = frames
+
+    def __getitem__(self, name):
+        return self.outputs[name][self.frames]
+
+    def __setitem__(self, name, value):
+        if isinstance(self.frames, slice) and self.frames == slice(None):
+            self.outputs[name] = value
+        else:
+            self.outputs.allocate(name)[self.frames] = value
+
+
+class Step():
+    """One function of a plan.
+
+    Attributes
+    ----------
+    kind : str
+        'axis' or 'angle'
+    index : int
+        Index of the function in the model's axis or angle functions.
+    function : callable
+    arguments : list of tuple
+        (slot, key) of each parameter, or (None, value) for a constant.
+    returns : list of tuple
+        (slot, name) of each returned value. Values returned for a point
+        as a (frames, 3, 4) axis are stored as their origin.
+    ndim : int
+        Number of dimensions of a single returned value, see map_returns.
+    free : list of tuple
+        (slot, name) of each output that is no longer needed after the step,
+        when steps are run one at a time.
+    dependencies, dependents : list of int
+        Positions in the plan of the steps this step uses the outputs of,
+        and of the steps that use its outputs.
+    outputs : list of tuple
+        (slot, name) of each output the step uses or returns.
+    """
+
+    def __init__(self, kind, index, function, arguments, returns, ndim, free, dependencies=(), outputs=()):
+        self.kind = kind
+        self.index = index
+        self.function = function
+        self.name = function.__name__
+        self.arguments = arguments
+        self.returns = returns
+        self.ndim = ndim
+        self.free = free
+        self.dependencies = list(dependencies)
+        self.dependents = []
+        self.outputs = list(outputs)
+
+    def __repr__(self):
+        return f'Step({self.kind!r}, {self.name!r})'
+
+
+class ExecutionPlan():
+    """Steps of a model, with every parameter resolved to a slot.
+
+    Compiled by `ExecutionPlan.compile`, and bound to each trial with `bind`.
+
+    Examples
+    --------
+    A plan pruned to the right knee angle runs five functions, frees the
+    other outputs, and gives the same angle as a full run.
+
+    >>> import contextlib, io, os
+    >>> import numpy as np
+    >>> from .model import Model
+    >>> files = os.path.normpath(os.path.join(os.path.dirname(__file__), '..', 'SampleData', 'Test_Files'))
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     model = Model(os.path.join(files, 'Static_trial.c3d'), [os.path.join(files, 'Movement_trial.c3d')],
+    ...                   os.path.join(files, 'Test.vsk'))
+    >>> trial = model.subject.dynamic['Movement_trial']
+    >>> plan = model.execution_plan(angles=['RKnee'])
+    >>> [step.name for step in plan.steps]
+    ['calc_axis_pelvis', 'calc_joint_center_hip', 'calc_axis_knee', 'calc_axis_ankle', 'calc_angle_knee']
+    >>> tables = plan.bind(trial.marker, trial.axes, trial.angles, trial.points)
+    >>> plan.run(tables)
+    >>> list(trial.angles.arrays), list(trial.axes.arrays), list(trial.points.arrays)
+    (['RKnee'], [], [])
+    >>> pruned = trial.angles['RKnee'].copy()
+    >>> with contextlib.redirect_stdout(io.StringIO()):
+    ...     model.run()
+    >>> np.array_equal(trial.angles['RKnee'], pruned, equal_nan=True)
+    True
+    """
+
+    def __init__(self, steps, measurements, pruned=()):
+        self.steps = steps
+        self.measurements = measurements
+        self.pruned = list(pruned)
+
+        for position, step in enumerate(steps):
+            for dependency in step.dependencies:
+                steps[dependency].dependents.append(position)
+
+        # Number of steps that use or return each output that is freed,
+        # for freeing it once they have all run in any order
+        freed = {output for step in steps for output in step.free}
+        self.uses = {output: sum(output in step.outputs for step in steps) for output in freed}
+
+    @classmethod
+    def compile(cls, model, outputs=None):
+        """Compile the axis and angle functions of a model into a plan.
+
+        Steps are in the order of ModelCreator.schedule, each after the
+        functions whose outputs it uses.
+
+        Parameters
+        ----------
+        model : ModelCreator
+            The model, with its subject loaded. Measurements are read from
+            the subject once, here.
+        outputs : set of tuple, optional
+            (kind, name) of the outputs to keep, see ModelCreator.selected_outputs.
+            Functions they do not need are left out of the plan.
+            Every function is run and every output kept by default.
+
+        Returns
+        -------
+        plan : ExecutionPlan
+        """
+        free_after = model.output_lifetimes(outputs)
+        measurements = {}
+
+        schedule = model.schedule(outputs)
+        functions, dependencies = model.function_graph()
+        position = {step: i for i, step in enumerate(schedule)}
+
+        # Outputs only returned by functions left out of the plan
+        returned = {output for step in schedule for output in model.function_outputs(step)}
+        pruned = dict.fromkeys((OUTPUT_SLOTS[output_kind], name)
+                               for step in functions if step not in position
+                               for output_kind, name in model.function_outputs(step)
+                               if (output_kind, name) not in returned)
+
+        steps = []
+        for kind, index in schedule:
+            if kind == 'axis':
+                function = model.axis_functions[index]
+                parameters = model.axis_func_parameter_names[index]
+                names = model.axis_function_to_return[function.__name__]
+
+                returns = [(POINTS if name in model.point_keys else AXES, name) for name in names]
+                ndim = 2 if names[0] in model.point_keys else 3
+            else:
+                function = model.angle_functions[index]
+                parameters = model.angle_func_parameter_names[index]
+                names = model.angle_function_to_return[function.__name__]
+
+                returns = [(ANGLES, name) for name in names]
+                ndim = 2
+
+            arguments = [cls.resolve(parameter, model.point_keys, measurements, model.subject)
+                         for parameter in parameters]
+
+            free = [(OUTPUT_SLOTS[output_kind], name) for output_kind, name in free_after.get((kind, index), [])]
+
+            used = model.function_inputs((kind, index)) + model.function_outputs((kind, index))
+            outputs = list(dict.fromkeys((OUTPUT_SLOTS[output_kind], name) for output_kind, name in used))
+
+            steps.append(Step(kind, index, function, arguments, returns, ndim, free,
+                              sorted(position[dependency] for dependency in dependencies[(kind, index)]), outputs))
+
+        return cls(steps, measurements, pruned)
+
+    @staticmethod
+    def resolve(parameter, point_keys, measurements, subject):
+        """Resolve a parameter object to its (slot, key), or (None, value) for a constant."""
+        if isinstance(parameter, Measurement):
+            measurements[parameter.name] = subject.measurement(parameter.name)
+            return (MEASUREMENTS, parameter.name)
+
+        if isinstance(parameter, Axis) and parameter.name in point_keys:
+            return (POINT_AXES, parameter.name)
+
+        if isinstance(parameter, (Marker, Axis, Angle, Point)):
+            return (parameter.dataset_index, parameter.name)
+
+        # Parameter is a constant, passed as is
+        return (None, parameter)
+
+    def bind(self, marker, axes, angles, points, frames=None):
+        """Get the tables of a trial, in slot order.
+
+        Parameters
+        ----------
+        marker : callable
+            Called with a marker name to get its (frames, 3) positions, or None
+            if the marker was not loaded, e.g. trial.Trial.marker
+        axes, angles, points : trial.Outputs or dict
+            Outputs of the trial
+        frames : slice or array of int, optional
+            Frames to bind, see `frame_index`. Steps run on the tables read
+            the markers and outputs over these frames, and only replace the
+            outputs over these frames. Every frame by default.
+
+        Returns
+        -------
+        tables : tuple
+        """
+        if frames is None:
+            return (self.measurements, MarkerTable(marker), axes, angles, points, PointAxisTable(points))
+
+        def marker_frames(name):
+            positions = marker(name)
+            return None if positions is None else positions[frames]
+
+        axes, angles, points = (FrameTable(outputs, frames) for outputs in (axes, angles, points))
+
+        return (self.measurements, MarkerTable(marker_frames), axes, angles, points, PointAxisTable(points))
+
+    def execute(self, step, tables, free=True):
+        """Run a step, storing its returned values in the tables.
+
+        Parameters
+        ----------
+        step : Step
+        tables : tuple
+            Tables returned by `bind`.
+        free : bool, optional
+            Set to False to keep the outputs the step would free.
+        """
+        parameters = [key if slot is None else tables[slot][key] for slot, key in step.arguments]
+        returned = step.function(*parameters)
+
+        for (slot, name), value in zip(step.returns, map_returns(returned, len(step.returns), step.ndim)):
+            if slot == POINTS and np.ndim(value) == 3:
+                # A (frames, 3, 4) axis returned for a point keeps only its origin
+                value = np.asarray(value)[:, :, 3]
+            tables[slot][name] = value
+
+        if free:
+            for slot, name in step.free:
+                del tables[slot][name]
+
+    def run(self, tables, pool=None, report=None):
+        """Run every step of the plan on a trial.
+
+        Parameters
+        ----------
+        tables : tuple
+            Tables returned by `bind`.
+        pool : concurrent.futures.Executor, optional
+            Pool to run steps that do not depend on each other at the same
+            time, e.g. a ThreadPoolExecutor. NumPy releases the GIL in its
+            kernels, so independent body segments run in parallel threads.
+            Steps run one at a time, in plan order, by default.
+        report : callable, optional
+            Called as report(step, seconds) after each step has run.
+
+        Notes
+        -----
+        Outputs of the functions left out of the plan are freed first, e.g.
+        those of an earlier run of every function, so that a trial only
+        holds the outputs the plan was compiled for.
+        """
+        for slot, name in self.pruned:
+            del tables[slot][name]
+
+        if pool is None:
+            for step in self.steps:
+                start = time.time()
+                self.execute(step, tables)
+                if report is not None:
+                    report(step, time.time() - start)
+            return
+
+        def timed(step):
+            start = time.time()
+            self.execute(step, tables, free=False)
+            return time.time() - start
+
+        # Steps are submitted once the steps they depend on have run. Outputs
+        # are freed once every step that uses them has run, since steps that
+        # do not depend on each other may finish in any order.
+        waiting = [len(step.dependencies) for step in self.steps]
+        uses = dict(self.uses)
+
+        running = {pool.submit(timed, step): step for step, count in zip(self.steps, waiting) if count == 0}
+        try:
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    step = running.pop(future)
+                    seconds = future.result()
+                    if report is not None:
+                        report(step, seconds)
+
+                    for output in step.outputs:
+                        if output in uses:
+                            uses[output] -= 1
+                            if uses[output] == 0:
+                                del tables[output[0]][output[1]]
+
+                    for dependent in step.dependents:
+                        waiting[dependent] -= 1
+                        if waiting[dependent] == 0:
+                            running[pool.submit(timed, self.steps[dependent])] = self.steps[dependent]
+        finally:
+            # Let steps already submitted finish before the trial's outputs are used
+            wait(running)
+
+    def dirty_frames(self, dirty, tables, num_frames):
+        """Find the frames each step has to run over after some of its inputs changed.
+
+        A step runs over the frames marked dirty for its function, and over
+        those of the steps it depends on. A step whose kept outputs are
+        missing, e.g. that was added or left out of an earlier plan, runs
+        over every frame. Steps that return a freed output a running step
+        uses run over the same frames again, to recompute it.
+
+        Parameters
+        ----------
+        dirty : dict
+            Maps function names to a (frames,) bool array of their dirty frames.
+        tables : tuple
+            Tables returned by `bind`, over every frame, whose outputs are
+            trial.Outputs. An output counts as missing unless it is in
+            their `computed`, since an output written over some frames
+            only holds zeros over the others.
+        num_frames : int
+
+        Returns
+        -------
+        masks : list
+            (frames,) bool array of the frames each step runs over, in plan
+            order, or None if the step does not run.
+        """
+        def missing(output):
+            slot, name = output
+            return name not in tables[slot].computed
+
+        masks = []
+        for step in self.steps:
+            mask = np.zeros(num_frames, dtype=bool)
+
+            if step.name in dirty:
+                mask |= dirty[step.name]
+
+            for dependency in step.dependencies:
+                if masks[dependency] is not None:
+                    mask |= masks[dependency]
+
+            # Kept outputs that are missing are computed over every frame
+            if any(output not in self.uses and missing(output) for output in step.returns):
+                mask[:] = True
+
+            masks.append(mask if mask.any() else None)
+
+        # Freed outputs used by a running step are computed again over its frames
+        for position in reversed(range(len(self.steps))):
+            if masks[position] is None:
+                continue
+
+            step = self.steps[position]
+            used = {(POINTS if slot == POINT_AXES else slot, key) for slot, key in step.arguments
+                    if slot in (AXES, ANGLES, POINTS, POINT_AXES)}
+
+            for dependency in step.dependencies:
+                if any(output in used and missing(output) for output in self.steps[dependency].returns):
+                    if masks[dependency] is None:
+                        masks[dependency] = masks[position].copy()
+                    else:
+                        masks[dependency] |= masks[position]
+
+        return masks
+
+    def update(self, marker, axes, angles, points, dirty, num_frames, report=None):
+        """Run the steps of a trial whose inputs changed, over the frames that changed.
+
+        Every axis and angle function operates on each frame independently,
+        so running a step over some frames gives the same values as running
+        it over the whole trial.
+
+        Parameters
+        ----------
+        marker, axes, angles, points
+            Markers and outputs of the trial, see `bind`.
+        dirty : dict
+            Maps function names to a (frames,) bool array of their dirty
+            frames, see `dirty_frames`.
+        num_frames : int
+        report : callable, optional
+            Called as report(step, seconds) after each step has run.
+
+        Returns
+        -------
+        run : list of Step
+            The steps that were run.
+        """
+        tables = self.bind(marker, axes, angles, points)
+
+        for slot, name in self.pruned:
+            del tables[slot][name]
+
+        computed = {(slot, name) for slot in OUTPUT_SLOTS.values() for name in tables[slot].computed}
+
+        run = []
+        for step, mask in zip(self.steps, self.dirty_frames(dirty, tables, num_frames)):
+            if mask is None:
+                continue
+
+            start = time.time()
+            self.execute(step, self.bind(marker, axes, angles, points, frame_index(mask)), free=False)
+            if report is not None:
+                report(step, time.time() - start)
+
+            run.append(step)
+
+        # Freed outputs computed again on the way are freed once more
+        for slot, name in self.uses:
+            if (slot, name) not in computed:
+                del tables[slot][name]
+
+        return run
+
+
+def frame_index(mask):
+    """Index the frames set in a (frames,) bool array, with a slice if they are consecutive."""
+    if mask.all():
+        return slice(None)
+
+    index = np.flatnonzero(mask)
+    if index[-1] - index[0] + 1 == len(index):
+        return slice(index[0], index[-1] + 1)
+
+    return index
+
+
+def map_returns(returned, count, ndim):
+    """Split the value(s) returned by a function into one value per returned name.
+
+    Parameters
+    ----------
+    returned : ndarray or list
+        Value returned by an axis or angle function. A list holds one
+        value per name, e.g. the elbow axes followed by the wrist joint
+        center points of calc_axis_elbow.
+    count : int
+        Number of returned names.
+    ndim : int
+        Number of dimensions of a single returned value,
+        3 for axes (frames, 3, 4), 2 for points and angles (frames, 3).
+
+    Returns
+    -------
+    values : list
+        Values of the returned names. Shorter than `count` if fewer values
+        were returned.
+    """
+    if isinstance(returned, (list, tuple)):
+        return list(returned)[:count]
+
+    returned = np.asarray(returned)
+    if returned.ndim > ndim:
+        # Multiple values returned by one function
+        return list(returned[:count])
+
+    return [returned]
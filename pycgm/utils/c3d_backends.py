@@ -0,0 +1,200 @@
+"""
+Interchangeable readers for the point data of c3d files.
+
+Every backend reads a file into the same C3DPoints container, so the loaders
+in new_io and pycgmIO work the same whichever library does the reading.
+`get_backend` uses the NumPy backend unless another one is named.
+"""
+
+import numpy as np
+
+from . import c3dpy3 as c3d
+
+try:
+    from ezc3d import c3d as ezc
+except ImportError:
+    ezc = None
+
+
+class C3DPoints():
+    """Point data of a c3d file, as read by a backend.
+
+    Attributes
+    ----------
+    labels : list of str
+        Name of each marker, in the order of the marker axis of `points`.
+    points : ndarray
+        A (frames, markers, 3) array of marker positions.
+        Positions of invalid points are NaN.
+    frame_numbers : ndarray
+        Frame index of each row of `points`, counted from the first frame in the file.
+    residuals : ndarray or None
+        A (frames, markers) array of residuals, -1 for invalid points.
+        None unless residuals were requested.
+    cameras : ndarray or None
+        A (frames, markers) array of the number of cameras that observed
+        each point, -1 for invalid points. None unless residuals were requested.
+    frame_rate : float or None
+        Point frames per second, from POINT:RATE.
+    """
+
+    def __init__(self, labels, points, frame_numbers, residuals=None, cameras=None, frame_rate=None):
+        self.labels = labels
+        self.points = points
+        self.frame_numbers = frame_numbers
+        self.residuals = residuals
+        self.cameras = cameras
+        self.frame_rate = frame_rate
+
+
+def select_markers(labels, markers=None):
+    """Map marker names to their column in a file.
+
+    Parameters
+    ----------
+    labels : list of str
+        Point labels of the file.
+    markers : list of str, optional
+        Names of the markers to keep. Names missing from `labels` are ignored.
+        Keeps every marker by default.
+
+    Returns
+    -------
+    marker_index : dict
+        Maps each kept marker name to its column.
+    """
+    marker_index = {label: i for i, label in enumerate(labels)}
+
+    if markers is not None:
+        marker_index = {name: marker_index[name] for name in markers if name in marker_index}
+
+    return marker_index
+
+
+class NumpyBackend():
+    """Pure NumPy backend, built on the bulk reads of `c3dpy3.Reader`."""
+
+    name = 'numpy'
+    supports_mmap = True
+    supports_residuals = True
+
+    def available(self):
+        return True
+
+    def read_points(self, filename, markers=None, frames=None, with_residuals=False):
+        marker_index, raw, scale, residual_scale, frame_numbers, frame_rate = self.map_points(filename, markers, frames, mmap=False)
+
+        columns = list(marker_index.values())
+        if columns != list(range(raw.shape[1])):
+            raw = raw[:, columns]
+
+        points = c3d.decode_points(raw, scale)[:, :, :3]
+
+        residuals = cameras = None
+        if with_residuals:
+            residuals, cameras = c3d.decode_residuals(raw, residual_scale)
+
+        return C3DPoints(list(marker_index), points, frame_numbers, residuals, cameras, frame_rate)
+
+    def map_points(self, filename, markers=None, frames=None, mmap=True):
+        """Get the raw, undecoded point words of a file.
+
+        Returns
+        -------
+        This returns a (marker_index, raw, scale, residual_scale, frame_numbers,
+        frame_rate) tuple. `raw` is the (frames, points, 4) block of
+        `c3dpy3.Reader.point_block`, a memory map if `mmap` is True.
+        `marker_index` maps the selected markers to their column in `raw`.
+        `scale` and `residual_scale` convert stored words to coordinates and
+        residuals.
+        """
+        with open(filename, 'rb') as handle:
+            reader = c3d.Reader(handle)
+            labels = reader.get('POINT:LABELS').string_array[:reader.points_per_frame()]
+            marker_index = select_markers([str(label.rstrip()) for label in labels], markers)
+
+            raw = reader.point_block(mmap=mmap, frames=frames)
+            scale = reader.point_scale()
+
+            # residuals are scaled by POINT:SCALE, even in float files
+            residual_scale = abs(reader.scale_factor())
+
+            num_frames = reader.last_frame() - reader.first_frame() + 1
+            frame_rate = reader.frame_rate()
+
+        frame_numbers = np.arange(num_frames)[frames or slice(None)]
+
+        return marker_index, raw, scale, residual_scale, frame_numbers, frame_rate
+
+
+class EZC3DBackend():
+    """Backend using the ezc3d library, if it is installed."""
+
+    name = 'ezc3d'
+    supports_mmap = False
+    supports_residuals = False
+
+    def available(self):
+        return ezc is not None
+
+    def read_points(self, filename, markers=None, frames=None, with_residuals=False):
+        if with_residuals:
+            raise ValueError('the ezc3d backend does not read residuals')
+
+        data = ezc(filename)
+
+        labels = [str(label).rstrip() for label in data['parameters']['POINT']['LABELS']['value']]
+        marker_index = select_markers(labels, markers)
+
+        # ezc3d stores points as (4, markers, frames), invalid points are already NaN
+        points = data['data']['points']
+        frame_numbers = np.arange(points.shape[2])[frames or slice(None)]
+        points = points[:3, list(marker_index.values())][:, :, frames or slice(None)].transpose(2, 1, 0)
+
+        frame_rate = float(data['parameters']['POINT']['RATE']['value'][0])
+
+        return C3DPoints(list(marker_index), np.ascontiguousarray(points, dtype=float), frame_numbers, frame_rate=frame_rate)
+
+
+# in order of preference. ezc3d decodes the whole file, analog data included,
+# so it is only used when it is asked for by name.
+BACKENDS = [NumpyBackend(), EZC3DBackend()]
+
+
+def get_backend(name=None, mmap=False, residuals=False):
+    """Get a c3d backend.
+
+    Parameters
+    ----------
+    name : str, optional
+        Name of the backend to use, 'numpy' or 'ezc3d'. The NumPy backend
+        is used by default.
+    mmap : bool, optional
+        Set to True if the backend must be able to memory-map files.
+    residuals : bool, optional
+        Set to True if the backend must be able to read residuals.
+
+    Returns
+    -------
+    backend : NumpyBackend or EZC3DBackend
+
+    Raises
+    ------
+    ValueError, if the named backend does not exist, is not installed,
+    or does not support the requested features.
+    """
+    for backend in BACKENDS:
+        if name is not None and backend.name != name:
+            continue
+
+        usable = backend.available() and \
+                 (backend.supports_mmap or not mmap) and \
+                 (backend.supports_residuals or not residuals)
+
+        if usable:
+            return backend
+
+        if name is not None:
+            raise ValueError(f'c3d backend {name} is not installed or does not support this load')
+
+    raise ValueError(f'unknown c3d backend {name}')
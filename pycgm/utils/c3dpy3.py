@@ -21,7 +21,6 @@
 '''A Python library for reading and writing C3D files.'''
 
 import array
-import io
 import operator
 import struct
 import warnings
@@ -305,6 +304,35 @@ class Param(object):
         size, = struct.unpack('B', handle.read(1))
         self.desc = size and handle.read(size).decode('utf-8') or ''
 
+    def read_from(self, buffer, offset):
+        '''Read binary data for this parameter from a buffer.
+
+        This is the same as `read`, but takes the parameter from a position in
+        an in-memory buffer without copying the rest of the buffer.
+
+        Arguments
+        ---------
+        buffer : memoryview
+            A view of the raw parameter section.
+        offset : int
+            Position of this parameter's data in `buffer`, just after the
+            offset to the next parameter.
+
+        Returns
+        -------
+        The position in `buffer` just past the end of this parameter.
+        '''
+        self.bytes_per_element, dims = struct.unpack_from('bB', buffer, offset)
+        offset += 2
+        self.dimensions = list(struct.unpack_from('B' * dims, buffer, offset))
+        offset += dims
+        self.bytes = bytes(buffer[offset:offset + self.total_bytes])
+        offset += self.total_bytes
+        size, = struct.unpack_from('B', buffer, offset)
+        offset += 1
+        self.desc = size and bytes(buffer[offset:offset + size]).decode('utf-8') or ''
+        return offset + size
+
     def _as(self, fmt):
         '''Unpack the raw bytes of this param using the given struct format.'''
         return struct.unpack('<' + fmt, self.bytes)[0]
@@ -753,31 +781,39 @@ class Reader(Manager):
                 format(processor))
 
         # read all parameter blocks as a single chunk to avoid block
-        # boundary issues.
-        bytes = self._handle.read(512 * parameter_blocks - 4)
-        while bytes:
-            buf = io.BytesIO(bytes)
-
-            chars_in_name, group_id = struct.unpack('bb', buf.read(2))
+        # boundary issues. entries are parsed in place by offset, the chunk
+        # is never sliced or copied.
+        buffer = memoryview(self._handle.read(512 * parameter_blocks - 4))
+        offset = 0
+        while offset + 4 <= len(buffer):
+            chars_in_name, group_id = struct.unpack_from('bb', buffer, offset)
             if group_id == 0 or chars_in_name == 0:
                 # we've reached the end of the parameter section.
                 break
 
-            name = buf.read(abs(chars_in_name)).decode('utf-8').upper()
-            offset_to_next, = struct.unpack('<h', buf.read(2))
+            offset += 2
+            name = bytes(buffer[offset:offset + abs(chars_in_name)]).decode('utf-8').upper()
+            offset += abs(chars_in_name)
+            offset_to_next, = struct.unpack_from('<h', buffer, offset)
+
+            # the offset to the next entry is counted from the offset itself
+            next_offset = offset + offset_to_next
+            offset += 2
 
             if group_id > 0:
                 # we've just started reading a parameter. if its group doesn't
                 # exist, create a blank one. add the parameter to the group.
-                self.setdefault(group_id, Group()).add_param(name, handle=buf)
+                param = Param(name)
+                param.read_from(buffer, offset)
+                self.setdefault(group_id, Group())[name] = param
             else:
                 # we've just started reading a group. if a group with the
                 # appropriate id exists already (because we've already created
                 # it for a parameter), just set the name of the group.
                 # otherwise, add a new group.
                 group_id = abs(group_id)
-                size, = struct.unpack('B', buf.read(1))
-                desc = size and buf.read(size).decode('utf-8') or ''
+                size, = struct.unpack_from('B', buffer, offset)
+                desc = size and bytes(buffer[offset + 1:offset + 1 + size]).decode('utf-8') or ''
                 group = self.get(group_id)
                 if group is not None:
                     group.name = name
@@ -787,7 +823,11 @@ class Reader(Manager):
                     try: self.add_group(group_id, name, desc)
                     except: print("C3D Conflict of Information: ",group_id,name,desc)
 
-            bytes = bytes[2 + abs(chars_in_name) + offset_to_next:]
+            # an offset of 0 marks the last entry in the section
+            if offset_to_next == 0:
+                break
+
+            offset = next_offset
 
         self.check_metadata()
 
@@ -840,30 +880,10 @@ class Reader(Manager):
         points = np.zeros((ppf, dim), float)
         # points = np.zeros((ppf, dim), dtype)
 
-        # TODO: handle ANALOG:BITS parameter here!
-        p = self.get('ANALOG:FORMAT')
-        analog_unsigned = p and p.string_value.strip().upper() == 'UNSIGNED'
-        analog_dtype = np.int16
-        if is_float:
-            analog_dtype = np.float32
-        elif analog_unsigned:
-            analog_dtype = np.uint16
+        analog_dtype = self.analog_dtype()
         analog = np.array([], float)
 
-        offsets = np.zeros((apf, ), int)
-        param = self.get('ANALOG:OFFSET')
-        if param is not None:
-            offsets = param.int16_array[:apf]
-
-        scales = np.ones((apf, ), float)
-        param = self.get('ANALOG:SCALE')
-        if param is not None:
-            scales = param.float_array[:apf]
-
-        gen_scale = 1.
-        param = self.get('ANALOG:GEN_SCALE')
-        if param is not None:
-            gen_scale = param.float_value
+        offsets, scales, gen_scale = self.analog_calibration()
 
         self._handle.seek((self.header.data_block - 1) * 512)
         for frame_no in range(self.first_frame(), self.last_frame() + 1):
@@ -876,14 +896,9 @@ class Reader(Manager):
             if onlyXYZ==True:
                 points[~valid,:] = np.nan
             else:
-                points[~valid, 3:5] = -1
-                c = raw[valid, 3].astype(np.uint16)
-
-                # fourth value is floating-point (scaled) error estimate
-                points[valid, 3] = (c & 0xff).astype(float) * scale
-
+                # fourth value is floating-point (scaled) error estimate,
                 # fifth value is number of bits set in camera-observation byte
-                points[valid, 4] = sum((c & (1 << k)) >> k for k in range(8, 17))
+                points[:, 3], points[:, 4] = decode_residuals(raw, scale)
 
             if self.header.analog_count > 0:
                 raw = np.fromfile(self._handle, dtype=analog_dtype,
@@ -901,6 +916,253 @@ class Reader(Manager):
                 else:
                     yield frame_no, points, analog
 
+    def read_points(self, frames=None):
+        '''Read the point data for every frame in a single pass.
+
+        The whole data section is read with one call, the analog samples that
+        are interleaved with the point data are skipped over with a strided
+        view, and scaling and invalid-point masking are applied to all frames
+        at once.
+
+        Arguments
+        ---------
+        frames : slice, optional
+            Window of frames to read, counted from the first frame in the file.
+
+        Returns
+        -------
+        points : ndarray
+            A (frames, points, 4) float array. The first three values of the
+            last axis are the scaled (x, y, z) coordinates of each point, the
+            fourth is the raw residual word. Coordinates of points flagged as
+            invalid (residual word of -1) are NaN.
+        '''
+        return decode_points(self.point_block(frames=frames), self.point_scale())
+
+    def point_block(self, mmap=False, frames=None):
+        '''Get the raw, undecoded point words of the data section.
+
+        Arguments
+        ---------
+        mmap : bool
+            Set this to True to memory-map the data section instead of reading
+            it. Nothing is read from disk until the returned array is indexed,
+            and only the pages that are touched are loaded.
+
+        frames : slice, optional
+            Window of frames to get, counted from the first frame in the file.
+            Frames outside of the window are not read.
+
+        Returns
+        -------
+        A (frames, points, 4) array of the stored point words, in the file's
+        own int16 or float32 format. The analog samples that follow the points
+        in each frame are skipped with a strided view.
+        '''
+        ppf = self.points_per_frame()
+        raw = self._data_section(mmap=mmap, frames=frames)
+
+        # drop the analog samples at the end of each frame
+        return raw[:, :4 * ppf].reshape((-1, ppf, 4))
+
+    def analog_block(self, mmap=False, frames=None):
+        '''Get the raw, undecoded analog words of the data section.
+
+        Arguments
+        ---------
+        mmap : bool
+            Set this to True to memory-map the data section instead of reading
+            it.
+
+        frames : slice, optional
+            Window of point frames to get, counted from the first frame in the
+            file. Every analog sample recorded during those frames is returned.
+
+        Returns
+        -------
+        A (frames, samples per frame, channels) array of the stored analog
+        words, in the format given by `analog_dtype`. The point words at the
+        start of each frame are skipped with a strided view.
+        '''
+        apf = self.analog_per_frame()
+        raw = self._data_section(mmap=mmap, frames=frames)
+
+        # the analog words share the storage of the point words, an unsigned
+        # format only changes how the 16 bits are interpreted
+        analog = raw[:, 4 * self.header.point_count:].view(self.analog_dtype())
+        if apf == 0:
+            return analog.reshape((raw.shape[0], 0, 0))
+        return analog.reshape((raw.shape[0], -1, apf))
+
+    def read_analog(self, frames=None):
+        '''Read the analog data for every frame in a single pass.
+
+        The analog samples are taken from the interleaved data section with a
+        strided view, and the ANALOG:OFFSET, ANALOG:SCALE and ANALOG:GEN_SCALE
+        parameters are applied to all samples at once.
+
+        Arguments
+        ---------
+        frames : slice, optional
+            Window of point frames to read, counted from the first frame in the
+            file.
+
+        Returns
+        -------
+        analog : ndarray
+            A (samples, channels) float array. There are analog-fps /
+            point-fps samples for every point frame.
+        '''
+        offsets, scales, gen_scale = self.analog_calibration()
+        raw = self.analog_block(frames=frames)
+
+        analog = raw.reshape((-1, raw.shape[2]) if raw.size else (0, raw.shape[2])).astype(float)
+        analog -= offsets
+        analog *= scales * gen_scale
+
+        return analog
+
+    def _data_section(self, mmap=False, frames=None):
+        '''Get the raw (frames, words per frame) array of the data section.'''
+        point_dtype = [np.int16, np.float32][self.scale_factor() < 0]
+
+        num_frames = self.last_frame() - self.first_frame() + 1
+        frame_words = 4 * self.header.point_count + self.header.analog_count
+        data_start = (self.header.data_block - 1) * 512
+
+        start, stop, step = (frames or slice(None)).indices(num_frames)
+        if step < 1:
+            raise ValueError('frame window must have a positive step, got {}'.format(step))
+
+        # only the frames inside the window are read
+        data_start += start * frame_words * np.dtype(point_dtype).itemsize
+        num_frames = max(stop - start, 0)
+
+        if mmap:
+            raw = np.memmap(self._handle, dtype=point_dtype, mode='r',
+                offset=data_start, shape=(num_frames, frame_words))
+        else:
+            self._handle.seek(data_start)
+            raw = np.fromfile(self._handle, dtype=point_dtype,
+                count=num_frames * frame_words).reshape((num_frames, frame_words))
+
+        return raw[::step]
+
+    def read_residuals(self, frames=None):
+        '''Read the residual and camera count of every point in a single pass.
+
+        Arguments
+        ---------
+        frames : slice, optional
+            Window of frames to read, counted from the first frame in the file.
+
+        Returns
+        -------
+        This returns a (residuals, cameras) tuple of (frames, points) float
+        arrays. See `decode_residuals`.
+        '''
+        return decode_residuals(self.point_block(frames=frames), abs(self.scale_factor()))
+
+    def point_scale(self):
+        '''Get the factor that converts stored point words to coordinates.'''
+        return [abs(self.scale_factor()), 1][self.scale_factor() < 0]
+
+    def analog_dtype(self):
+        '''Get the numpy dtype of the stored analog words.'''
+        # TODO: handle ANALOG:BITS parameter here!
+        if self.scale_factor() < 0:
+            return np.float32
+        p = self.get('ANALOG:FORMAT')
+        if p and p.string_value.strip().upper() == 'UNSIGNED':
+            return np.uint16
+        return np.int16
+
+    def analog_calibration(self):
+        '''Get the (offsets, scales, gen_scale) used to convert analog words.
+
+        Analog values are (word - offset) * scale * gen_scale, with one offset
+        and scale per channel.
+        '''
+        apf = self.analog_per_frame()
+
+        offsets = np.zeros((apf, ), int)
+        param = self.get('ANALOG:OFFSET')
+        if param is not None:
+            offsets = param.int16_array[:apf]
+
+        scales = np.ones((apf, ), float)
+        param = self.get('ANALOG:SCALE')
+        if param is not None:
+            scales = param.float_array[:apf]
+
+        gen_scale = 1.
+        param = self.get('ANALOG:GEN_SCALE')
+        if param is not None:
+            gen_scale = param.float_value
+
+        return offsets, scales, gen_scale
+
+
+def decode_points(raw, scale):
+    '''Convert raw point words to scaled coordinates.
+
+    Arguments
+    ---------
+    raw : ndarray
+        An array of raw point words with 4 values on the last axis, as
+        returned by `Reader.point_block`.
+    scale : float
+        Multiply the stored coordinates by this factor.
+
+    Returns
+    -------
+    A float array of the same shape as `raw`. The first three values of the
+    last axis are the scaled (x, y, z) coordinates, the fourth is the raw
+    residual word. Coordinates of invalid points are NaN.
+    '''
+    points = np.array(raw, dtype=float)
+    points[..., :3] *= scale
+
+    invalid = ~(points[..., 3] > -1)
+    points[invalid, :3] = np.nan
+
+    return points
+
+
+# number of bits set in each possible camera-observation byte
+CAMERA_COUNTS = np.array([bin(byte).count('1') for byte in range(256)])
+
+
+def decode_residuals(raw, scale):
+    '''Decode the residual word of raw point data.
+
+    Arguments
+    ---------
+    raw : ndarray
+        An array of raw point words with 4 values on the last axis, as
+        returned by `Reader.point_block`.
+    scale : float
+        Multiply the residuals by this factor, the absolute value of the
+        POINT:SCALE parameter.
+
+    Returns
+    -------
+    This returns a (residuals, cameras) tuple of float arrays with the shape of
+    `raw` minus its last axis. The residuals are the floating-point (scaled)
+    error estimates of each point, the cameras are the number of cameras that
+    observed each point. Both are -1 for invalid points.
+    '''
+    word = np.asarray(raw[..., 3])
+    valid = word > -1
+
+    # invalid words are set to 0 before the cast to avoid float -> int overflow
+    word = np.where(valid, word, 0).astype(np.uint16)
+
+    residuals = np.where(valid, (word & 0xff) * scale, -1.)
+    cameras = np.where(valid, CAMERA_COUNTS[word >> 8], -1).astype(float)
+
+    return residuals, cameras
+
 
 class Writer(Manager):
     '''This class manages the task of writing metadata and frames to a C3D file.
@@ -0,0 +1,160 @@
+"""
+Calibrated subject measurements, shared between models.
+
+A `Calibration` holds the static trial of a subject and the measurements
+calibrated from it and the subject's .vsk. Passing one calibration to many
+`Model`s runs the static calibration once for all of them. A
+`CalibrationStore` keeps calibrations on disk, keyed by the contents of the
+static trial and .vsk, so that later sessions reuse them as well.
+"""
+
+import numpy as np
+
+from ..calc.calibration import CalcStatic
+from .new_io import load_c3d, loadVSK, marker_positions
+from .trial_cache import TrialCache
+
+
+def structure_measurements(measurements):
+    """Structure calibrated measurements.
+
+    Parameters
+    ----------
+    measurements : list
+        [names, values] of the calibrated measurements.
+
+    Returns
+    -------
+    measurements_struct : structured array
+        One field per measurement. GCS is a (3, 3) field.
+    """
+    sm_names = measurements[0]
+    sm_dtype = []
+    for key in sm_names:
+        if key == "GCS":
+            sm_dtype.append((key, 'f8', (3,3)))
+        else:
+            sm_dtype.append((key, 'f8'))
+    measurements_struct = np.array(tuple(measurements[1]), dtype=sm_dtype)
+    return measurements_struct
+
+
+def calibrate_static(static_trial, measurement_filename, estimator='mean', stance_window=None):
+    """Calibrate the subject measurements of a .vsk with a static trial.
+
+    Parameters
+    ----------
+    static_trial : structured array
+        Static trial markers, as returned by new_io.load_c3d
+    measurement_filename : str
+        Filename of the subject measurement .vsk
+    estimator, stance_window : optional
+        See calc.calibration.CalcStatic
+
+    Returns
+    -------
+    measurements_struct : structured array
+        The calibrated measurements, see `structure_measurements`.
+    """
+    uncalibrated_measurements = loadVSK(measurement_filename)
+    uncalibrated_measurements_dict = dict(zip(uncalibrated_measurements[0], uncalibrated_measurements[1]))
+
+    # calibrate subject measurements over all static frames at once
+    calibrated_measurements_dict = CalcStatic(estimator, stance_window=stance_window).get_static(marker_positions(static_trial), uncalibrated_measurements_dict)
+    calibrated_measurements_split = [list(calibrated_measurements_dict.keys()), list(calibrated_measurements_dict.values())]
+
+    return structure_measurements(calibrated_measurements_split)
+
+
+class Calibration():
+    """Static trial and calibrated measurements of a subject.
+
+    Attributes
+    ----------
+    static_trial : structured array
+        Static trial markers, as returned by new_io.load_c3d
+    measurements : structured array
+        Calibrated measurements, including GCS.
+    static_filename, measurement_filename : str
+        Files the calibration was made from.
+    """
+
+    def __init__(self, static_trial, measurements, static_filename=None, measurement_filename=None):
+        self.static_trial = static_trial
+        self.measurements = measurements
+        self.static_filename = static_filename
+        self.measurement_filename = measurement_filename
+
+    def __repr__(self):
+        return f'Calibration({self.static_filename!r}, {self.measurement_filename!r})'
+
+
+class CalibrationStore():
+    """On-disk store of calibrations.
+
+    Calibrations are keyed by the contents of the static trial and .vsk
+    they were made from, and by the calibration options. They are
+    calibrated again only after one of those changes.
+
+    Parameters
+    ----------
+    directory : str
+        Directory of the store. May be shared with a TrialCache,
+        e.g. the `cache_dir` of a Model.
+
+    Examples
+    --------
+    >>> store = CalibrationStore('.pycgm_cache') #doctest: +SKIP
+    >>> calibration = store.calibrate('RoboStatic.c3d', 'RoboSM.vsk') #doctest: +SKIP
+    >>> walk = Model(None, 'RoboWalk.c3d', None, calibration=calibration) #doctest: +SKIP
+    """
+
+    def __init__(self, directory):
+        self.cache = TrialCache(directory)
+
+    def calibrate(self, static_filename, measurement_filename, estimator='mean', stance_window=None):
+        """Get the calibration of a static trial and .vsk, calibrating on a miss.
+
+        Returns
+        -------
+        calibration : Calibration
+            Calibration whose arrays are memory-mapped from the store.
+        """
+        static_trial = self.cache.cached('markers', [static_filename], load_c3d, static_filename, markers=None)
+        measurements = self.cache.cached('measurements', [static_filename, measurement_filename],
+                                         calibrate_static, static_trial, measurement_filename,
+                                         estimator=estimator, stance_window=stance_window)
+
+        return Calibration(static_trial, measurements, static_filename, measurement_filename)
+
+
+def calibrate(static_filename, measurement_filename, store=None, estimator='mean', stance_window=None):
+    """Calibrate a subject, for use by one or more Models.
+
+    Parameters
+    ----------
+    static_filename : str
+        Filename of the static trial .c3d
+    measurement_filename : str
+        Filename of the subject measurement .vsk
+    store : CalibrationStore or str, optional
+        Store, or directory of a store, to reuse the calibration from and
+        save it to. The calibration is only kept in memory by default.
+    estimator, stance_window : optional
+        See calc.calibration.CalcStatic
+
+    Returns
+    -------
+    calibration : Calibration
+    """
+    if isinstance(store, str):
+        store = CalibrationStore(store)
+
+    if store is not None:
+        return store.calibrate(static_filename, measurement_filename, estimator, stance_window)
+
+    # the static trial is decoded once, for both calibration and the model struct
+    static_trial = load_c3d(static_filename)
+    measurements = calibrate_static(static_trial, measurement_filename, estimator, stance_window)
+
+    return Calibration(static_trial, measurements, static_filename, measurement_filename)
@@ -17,14 +17,14 @@ def diff_pycgm_csv(model, trial_name, csv_filename):
     angle_array_fields = ['Pelvis', 'RHip', 'LHip', 'RKnee', 'LKnee', 'RAnkle', 'LAnkle', 'RFoot', 'LFoot', 'Head', 'Thorax',
                           'Neck', 'Spine', 'RShoulder', 'LShoulder', 'RElbow', 'LElbow', 'RWrist', 'LWrist']
 
-    # 'Pelvis' in the structured axis array corresponds to 'PELO', 'PELX', 'PELY', 'PELZ' in the csv (12 values)
+    # 'Pelvis' in the axis columns corresponds to 'PELO', 'PELX', 'PELY', 'PELZ' in the csv (12 values)
     axis_slice_map = { key: slice( index*12, index*12+12, 1) for index, key in enumerate(axis_array_fields) }
 
-    # 'Pelvis' in the structured angle array corresponds to 'X', 'Y', 'Z' in the csv (3 values)
+    # 'Pelvis' in the angle columns corresponds to 'X', 'Y', 'Z' in the csv (3 values)
     angle_slice_map = { key: slice( index*3, index*3+3, 1) for index, key in enumerate(angle_array_fields) }
 
-    model_output_axes   = model.data.dynamic[trial_name].axes
-    model_output_angles = model.data.dynamic[trial_name].angles
+    model_output_axes   = model.subject.dynamic[trial_name].axes
+    model_output_angles = model.subject.dynamic[trial_name].angles
 
     csv_results = np.genfromtxt(csv_filename, delimiter=',')
     print(f"\nLoaded csv: {csv_filename}")
@@ -39,10 +39,10 @@ def diff_pycgm_csv(model, trial_name, csv_filename):
                 original_x = frame[slc.start + 3:slc.start + 6] - original_o
                 original_y = frame[slc.start + 6:slc.start + 9] - original_o
                 original_z = frame[slc.start + 9:slc.stop]      - original_o
-                refactored_x = model_output_axes[key][0][frame_idx][:, 0]
-                refactored_y = model_output_axes[key][0][frame_idx][:, 1]
-                refactored_z = model_output_axes[key][0][frame_idx][:, 2]
-                refactored_o = model_output_axes[key][0][frame_idx][:, 3]
+                refactored_x = model_output_axes[key][frame_idx][:, 0]
+                refactored_y = model_output_axes[key][frame_idx][:, 1]
+                refactored_z = model_output_axes[key][frame_idx][:, 2]
+                refactored_o = model_output_axes[key][frame_idx][:, 3]
                 if not np.allclose(original_o, refactored_o):
                     accurate = False
                     error = abs((original_o - refactored_o) / original_o) * 100
@@ -77,9 +77,9 @@ def diff_pycgm_csv(model, trial_name, csv_filename):
                 original_x = frame[slc][0]
                 original_y = frame[slc][1]
                 original_z = frame[slc][2]
-                refactored_x = model_output_angles[key][0][frame_idx][0]
-                refactored_y = model_output_angles[key][0][frame_idx][1]
-                refactored_z = model_output_angles[key][0][frame_idx][2]
+                refactored_x = model_output_angles[key][frame_idx][0]
+                refactored_y = model_output_angles[key][frame_idx][1]
+                refactored_z = model_output_angles[key][frame_idx][2]
                 if not np.allclose(original_x, refactored_x):
                     accurate = False
                     error = abs((original_x - refactored_x) / original_x) * 100
@@ -3,6 +3,7 @@ import xml.etree.ElementTree as ET
 
 import numpy as np
 
+from . import c3d_backends
 from . import c3dpy3 as c3d
 
 
@@ -11,7 +12,141 @@ def marker_dtype():
     return [('frame', 'f8'), ('point', point)]
 
 
-def load_c3d(filename, return_frame_count=False):
+def residual_dtype():
+    return [('residual', 'f8'), ('cameras', 'f8')]
+
+
+def marker_positions(markers_struct):
+    """Get the positions of every marker in a structured marker array.
+
+    Parameters
+    ----------
+    markers_struct : structured array
+        Marker data, as returned by load_c3d
+
+    Returns
+    -------
+    positions : dict
+        Maps each marker name to a (frames, 3) view of its positions in `markers_struct`.
+    """
+    names = markers_struct.dtype.names
+    num_frames = markers_struct.dtype[0].shape[0]
+
+    # (markers, frames, frame number + xyz) view of the whole struct
+    positions = markers_struct.view(np.float64).reshape(len(names), num_frames, 4)[:, :, 1:]
+
+    return dict(zip(names, positions))
+
+
+class MappedMarkers():
+    """Marker trajectories of a memory-mapped c3d file, decoded on demand.
+
+    Holds a memory map of the file's point data instead of a decoded copy.
+    A marker's words are only read from disk, scaled and masked the first
+    time the marker is requested, so memory use follows the markers that
+    are actually used rather than the size of the file.
+
+    Parameters
+    ----------
+    raw : memmap
+        A (frames, points, 4) memory map of the raw point words,
+        as returned by `c3dpy3.Reader.point_block`.
+    index : dict
+        Maps each marker name to its column in `raw`.
+    scale : float
+        Factor converting stored point words to coordinates.
+    frame_numbers : array, optional
+        Frame index of each row of `raw`. Defaults to 0, 1, 2, ...
+    dtype : dtype, optional
+        Float type of the decoded markers. The default is float64.
+    """
+
+    def __init__(self, raw, index, scale, frame_numbers=None, dtype=np.float64):
+        self.raw = raw
+        self.index = index
+        self.names = list(index)
+        self.scale = scale
+        self.dtype = np.dtype(dtype)
+        self.num_frames = raw.shape[0]
+        self.frame_numbers = np.arange(self.num_frames) if frame_numbers is None else frame_numbers
+        self.decoded = {}
+
+    def __contains__(self, name):
+        return name in self.index or name in self.decoded
+
+    def __getitem__(self, name):
+        """Decode a single marker into a (frames, 3) array."""
+        if name not in self.decoded:
+            points = c3d.decode_points(self.raw[:, self.index[name]], self.scale)
+            self.decoded[name] = points[:, :3].astype(self.dtype, copy=False)
+
+        return self.decoded[name]
+
+    def extend(self, markers):
+        """Add virtual markers, given a dict mapping each new name to its (frames, 3) positions.
+
+        Virtual markers are kept in memory alongside the decoded markers.
+
+        Raises
+        ------
+        ValueError
+            If a marker is already in the file, or its positions are not
+            (frames, 3). No marker is added then.
+        """
+        markers = {name: np.asarray(positions, dtype=self.dtype) for name, positions in markers.items()}
+
+        for name, positions in markers.items():
+            if name in self:
+                raise ValueError(f'Marker {name} is already in the trial')
+            if positions.shape != (self.num_frames, 3):
+                raise ValueError(f'{name} has shape {positions.shape}, expected {(self.num_frames, 3)}')
+
+        self.decoded.update(markers)
+        self.names.extend(markers)
+
+    def write(self, name, frames, positions):
+        """Overwrite the positions of a marker over some frames, in memory only.
+
+        The marker is decoded and copied first, so the file and any array
+        passed to `extend` are left unchanged.
+        """
+        markers = self[name].copy()
+        markers[frames] = positions
+        self.decoded[name] = markers
+
+    def get(self, names, points_only=True):
+        """Decode a list of markers.
+
+        Parameters
+        ----------
+        names : str or list of str
+            Name(s) of the markers to be decoded.
+        points_only : bool, optional
+            Set to False to include the frame number as the first column.
+
+        Returns
+        -------
+        markers : ndarray
+            A (markers, frames, 3) array, or (markers, frames, 4) if
+            `points_only` is False. None if any of the markers is not
+            in the file.
+        """
+        if isinstance(names, str):
+            names = [names]
+
+        if any(name not in self for name in names):
+            return None
+
+        markers = np.array([self[name] for name in names])
+
+        if not points_only:
+            frame_numbers = np.broadcast_to(self.frame_numbers.astype(float), markers.shape[:2])
+            markers = np.concatenate([frame_numbers[:, :, np.newaxis], markers], axis=2)
+
+        return markers
+
+
+def load_c3d(filename, return_frame_count=False, mmap=False, markers=None, frames=None, with_residuals=False, backend=None):
     """Loads motion capture data from a c3d file into a numpy structured array.
 
     Parameters
@@ -22,39 +157,288 @@ def load_c3d(filename, return_frame_count=False):
     return_frame_count : bool, optional
         Set to True to return the number of frames as well
 
+    mmap : bool, optional
+        Set to True to memory-map the file instead of decoding it.
+        Markers are then decoded individually, the first time they are used.
+
+    markers : list of str, optional
+        Names of the markers to be loaded. Other markers in the file are
+        neither decoded nor stored. Names missing from the file are ignored.
+        Loads every marker by default.
+
+    frames : slice, optional
+        Window of frames to be loaded, counted from the first frame in the file,
+        e.g. slice(120, 240) for a single gait cycle. Loads every frame by default.
+
+    with_residuals : bool, optional
+        Set to True to return the residual and camera count of every marker as well
+
+    backend : str, optional
+        Name of the c3d backend to read the file with, 'numpy' or 'ezc3d'.
+        Uses the NumPy backend by default.
+        See c3d_backends.get_backend.
+
     Returns
     -------
-    dynamic_struct : array
-        A structured array of the file's marker data
+    dynamic_struct : array or MappedMarkers
+        A structured array of the file's marker data, or a MappedMarkers
+        over the file if `mmap` is True
+
+    residual_struct : array
+        Only returned if `with_residuals` is True. A structured array of
+        each marker's residual and number of contributing cameras, both -1
+        in frames where the marker is invalid.
+        e.g. residual_struct['LASI'][0]['cameras']
     """
 
     start = time.time()
 
-    reader = c3d.Reader(open(filename, 'rb'))
-    labels = reader.get('POINT:LABELS').string_array
-    frames_list = np.array(list(reader.read_frames(True, True, yield_frame_no=False)), dtype=object)
+    engine = c3d_backends.get_backend(backend, mmap=mmap, residuals=with_residuals)
+
+    if mmap:
+        marker_index, raw, scale, _, frame_numbers, _ = engine.map_points(filename, markers, frames)
+        dynamic_struct = MappedMarkers(raw, marker_index, scale, frame_numbers)
+
+    # residuals are decoded from the same block as the points, so they are
+    # read even when the points themselves are memory-mapped
+    if with_residuals or not mmap:
+        trial = engine.read_points(filename, markers, frames, with_residuals=with_residuals)
+        marker_names, frame_numbers = trial.labels, trial.frame_numbers
+
+    num_frames = frame_numbers.shape[0]
+    returned = [dynamic_struct] if mmap else []
+
+    if not mmap:
+        marker_xyz = [(key, (marker_dtype(), (num_frames,))) for key in marker_names]
+        dynamic_struct = np.empty((1), dtype=marker_xyz)
 
-    marker_names = [str(label.rstrip()) for label in labels]
-    num_markers = len(frames_list[0][0])
-    num_frames = len(frames_list)
-    frame_numbers = np.arange(num_frames)
-    float_arr = np.column_stack(frames_list[:, 0]).astype(np.float).reshape(num_markers, num_frames, 3)
+        # The marker fields are laid out back to back, so the whole struct
+        # can be filled through a single (markers, frames, 4) float view
+        marker_positions = dynamic_struct.view(np.float64).reshape(len(marker_names), num_frames, 4)
+        marker_positions[:, :, 0] = frame_numbers
+        marker_positions[:, :, 1:] = trial.points.transpose(1, 0, 2)
 
-    marker_xyz = [(key, (marker_dtype(), (num_frames,))) for key in marker_names]
-    marker_positions = np.insert(float_arr, 0, frame_numbers, axis=2)
-    marker_positions.dtype = marker_dtype()
+        returned.append(dynamic_struct)
 
-    dynamic_struct = np.empty((1), dtype=marker_xyz)
-    for i, name in enumerate(dynamic_struct.dtype.names):
-        dynamic_struct[name][0][:, np.newaxis] = marker_positions[i]
+    if with_residuals:
+        residual_fields = [(key, (residual_dtype(), (num_frames,))) for key in marker_names]
+        residual_struct = np.empty((1), dtype=residual_fields)
+
+        marker_residuals = residual_struct.view(np.float64).reshape(len(marker_names), num_frames, 2)
+        marker_residuals[:, :, 0] = trial.residuals.T
+        marker_residuals[:, :, 1] = trial.cameras.T
+
+        returned.append(residual_struct)
 
     end = time.time()
     print(f'Time to read/structure {filename}: {end - start}')
 
     if return_frame_count:
-        return dynamic_struct, num_frames
+        returned.append(num_frames)
+
+    if len(returned) == 1:
+        return dynamic_struct
+
+    return tuple(returned)
+
+
+def load_c3d_analog(filename, channels=None, frames=None):
+    """Open and load the analog data of a c3d file.
+
+    The analog block is read in one pass, and the channel offsets and
+    scales are applied to every sample at once.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the c3d file to be loaded.
+
+    channels : list of str, optional
+        Labels of the analog channels to be loaded, e.g. ['Force.Fz1'].
+        Loads every channel by default. Labels missing from the file are ignored.
+
+    frames : slice, optional
+        Window of point frames to be loaded, counted from the first frame in the file.
+        Loads every frame by default.
+
+    Returns
+    -------
+    analog : array
+        A (samples, channels) array of the scaled analog data.
+
+    labels : list of str
+        The label of each column of `analog`.
+
+    Examples
+    --------
+    >>> analog, labels = load_c3d_analog('SampleData/ROM/Sample_Static.c3d') #doctest: +SKIP
+    >>> analog[:, labels.index('Force.Fz1')] #doctest: +SKIP
+    """
+    start = time.time()
+
+    with open(filename, 'rb') as handle:
+        reader = c3d.Reader(handle)
+        analog = reader.read_analog(frames=frames)
+
+        param = reader.get('ANALOG:LABELS')
+        labels = []
+        if param is not None:
+            labels = [str(label.rstrip()) for label in param.string_array[:analog.shape[1]]]
+
+    if channels is not None:
+        columns = [labels.index(name) for name in channels if name in labels]
+        analog = analog[:, columns]
+        labels = [labels[i] for i in columns]
+
+    end = time.time()
+    print(f'Time to read analog {filename}: {end - start}')
+
+    return analog, labels
+
+
+def probe_c3d(filename):
+    """Read the metadata of a c3d file without touching its data section.
+
+    Only the header and parameter section are read, so files can be
+    indexed and triaged before any of them are fully loaded.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the c3d file to be probed.
+
+    Returns
+    -------
+    info : dict
+        Dictionary with the keys
+        'labels'         : list of str, the point labels
+        'analog_labels'  : list of str, the analog channel labels
+        'num_frames'     : int, the number of point frames
+        'first_frame'    : int, number of the first frame
+        'last_frame'     : int, number of the last frame
+        'frame_rate'     : float, point frames per second
+        'analog_rate'    : float, analog samples per second
+
+    Examples
+    --------
+    >>> info = probe_c3d('SampleData/ROM/Sample_Static.c3d') #doctest: +SKIP
+    >>> info['num_frames'] #doctest: +SKIP
+    """
+    with open(filename, 'rb') as handle:
+        reader = c3d.Reader(handle)
+
+        labels = []
+        param = reader.get('POINT:LABELS')
+        if param is not None:
+            labels = [str(label.rstrip()) for label in param.string_array[:reader.points_per_frame()]]
+
+        analog_labels = []
+        param = reader.get('ANALOG:LABELS')
+        if param is not None and reader.analog_per_frame():
+            analog_labels = [str(label.rstrip()) for label in param.string_array[:reader.analog_per_frame()]]
+
+        param = reader.get('ANALOG:RATE')
+        analog_rate = param.float_value if param is not None else 0.
+
+        first_frame = reader.first_frame()
+        last_frame = reader.last_frame()
+
+        return {'labels': labels,
+                'analog_labels': analog_labels,
+                'num_frames': last_frame - first_frame + 1,
+                'first_frame': first_frame,
+                'last_frame': last_frame,
+                'frame_rate': reader.frame_rate(),
+                'analog_rate': analog_rate}
+
+
+def iter_c3d_chunks(filename, chunk_size, markers=None):
+    """Iterate over the marker data of a c3d file in fixed-size windows of frames.
+
+    Only one window is read from disk and decoded at a time, so memory use
+    depends on `chunk_size` and not on the length of the trial.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the c3d file to be loaded.
+
+    chunk_size : int
+        Number of frames in each window. The last window may be shorter.
+
+    markers : list of str, optional
+        Names of the markers to be decoded. Decodes every marker by default.
+
+    Yields
+    ------
+    frames : slice
+        The window of frames in this chunk, counted from the first frame in the file.
+
+    chunk : dict
+        Maps each marker name to a (frames, 3) array of its positions in this window.
+    """
+
+    with open(filename, 'rb') as handle:
+        reader = c3d.Reader(handle)
+        labels = reader.get('POINT:LABELS').string_array
+        marker_index = {str(label.rstrip()): i for i, label in enumerate(labels)}
+
+        if markers is not None:
+            marker_index = {name: marker_index[name] for name in markers if name in marker_index}
+
+        num_frames = reader.last_frame() - reader.first_frame() + 1
+        scale = reader.point_scale()
+
+        for chunk_start in range(0, num_frames, chunk_size):
+            frames = slice(chunk_start, min(chunk_start + chunk_size, num_frames))
+
+            raw = reader.point_block(frames=frames)[:, list(marker_index.values())]
+            points = c3d.decode_points(raw, scale)
+
+            chunk = {name: points[:, i, :3] for i, name in enumerate(marker_index)}
+
+            yield frames, chunk
+
+
+class CSVStreamWriter():
+    """Sink for Model.run_stream that appends each chunk of output to a csv file.
+
+    Each row holds the frame number, then the x, y, z values of every angle,
+    then the x, y, z axes and origin of every axis.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the csv file to be written. An existing file is overwritten.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.handle = None
+
+    def __call__(self, trial_name, frames, axes, angles):
+        if self.handle is None:
+            self.handle = open(self.filename, 'w')
+
+            header = ['Frame']
+            header += [f'{name}_{c}' for name in angles for c in 'XYZ']
+            header += [f'{name}_{axis}{c}' for name in axes for axis in 'XYZO' for c in 'xyz']
+            self.handle.write(','.join(header) + '\n')
+
+        frame_numbers = np.arange(frames.start, frames.stop)[:, np.newaxis]
+        num_frames = frame_numbers.shape[0]
+
+        # (frames, 3, 4) axes are written column by column: x-axis, y-axis, z-axis, origin
+        columns  = [frame_numbers]
+        columns += [angle.reshape(num_frames, 3) for angle in angles.values()]
+        columns += [axis.transpose(0, 2, 1).reshape(num_frames, 12) for axis in axes.values()]
+
+        np.savetxt(self.handle, np.hstack(columns), delimiter=',', fmt='%.10g')
 
-    return dynamic_struct
+    def close(self):
+        if self.handle is not None:
+            self.handle.close()
+            self.handle = None
 
 
 def loadVSK(filename, dict=True):
@@ -4,40 +4,35 @@ This file is used for the input and output of pycgm functions.
 
 # Copyright (c) 2015 Mathew Schwartz <umcadop@gmail.com>
 
-import sys
-
-if sys.version_info[0] == 2:
-    import c3d
-    pyver = 2
-    print("Using python 2 c3d loader")
-
-else:
-    from . import c3dpy3 as c3d
-    pyver = 3
-    print("Using python 3 c3d loader - c3dpy3")
-
-try:
-    from ezc3d import c3d as ezc
-    useEZC3D = True
-    print("EZC3D Found, using instead of Python c3d")
-except:
-    useEZC3D = False
-
 import errno
 import os
+import sys
 import xml.etree.ElementTree as ET
 from math import *
 
 import numpy as np
 
+from . import c3d_backends
+
+pyver = sys.version_info[0]
+
+# Markers used by the CGM, filled with NaN in frames of files that lack them
+CGM_MARKERS = ['RASI', 'LASI', 'RPSI', 'LPSI', 'RTHI', 'LTHI', 'RKNE', 'LKNE', 'RTIB',
+               'LTIB', 'RANK', 'LANK', 'RTOE', 'LTOE', 'LFHD', 'RFHD', 'LBHD', 'RBHD',
+               'RHEE', 'LHEE', 'CLAV', 'C7', 'STRN', 'T10', 'RSHO', 'LSHO', 'RELB', 'LELB',
+               'RWRA', 'RWRB', 'LWRA', 'LWRB', 'RFIN', 'LFIN']
+
 
-def loadData(filename, rawData=True):
+def loadData(filename, rawData=True, backend=None):
     """Loads motion capture data from a c3d file.
 
     Parameters
     ----------
     filename : str
         Path of the c3d file to be loaded.
+    backend : str, optional
+        Name of the c3d backend to read the file with, 'numpy' or 'ezc3d'.
+        Uses the NumPy backend by default.
 
     Returns
     -------
@@ -74,14 +69,13 @@ def loadData(filename, rawData=True):
     print(filename)
 
     if str(filename).endswith('.c3d'):
-        reader = c3d.Reader(open(filename, 'rb'))
-        labels = reader.get('POINT:LABELS').string_array
+        trial = c3d_backends.get_backend(backend).read_points(filename)
         data = []
         dataunlabeled = []
 
-        markers = [str(label.rstrip()) for label in labels]
+        markers = trial.labels
 
-        for frame_no, points, analog in reader.read_frames(True, True):
+        for points in trial.points:
             data_dict = {}
             data_unlabeled = {}
             for label, point in zip(markers, points):
@@ -96,12 +90,8 @@ def loadData(filename, rawData=True):
             dataunlabeled.append(data_unlabeled)
 
         # add any missing keys
-        keys = ['RASI', 'LASI', 'RPSI', 'LPSI', 'RTHI', 'LTHI', 'RKNE', 'LKNE', 'RTIB',
-                'LTIB', 'RANK', 'LANK', 'RTOE', 'LTOE', 'LFHD', 'RFHD', 'LBHD', 'RBHD',
-                'RHEE', 'LHEE', 'CLAV', 'C7', 'STRN', 'T10', 'RSHO', 'LSHO', 'RELB', 'LELB',
-                'RWRA', 'RWRB', 'LWRA', 'LWRB', 'RFIN', 'LFIN']
         for frame in data:
-            for key in keys:
+            for key in CGM_MARKERS:
                 frame.setdefault(key, [np.nan, np.nan, np.nan])
         return data
 
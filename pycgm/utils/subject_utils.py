@@ -1,27 +1,28 @@
-import re
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from numpy.lib import recfunctions as rfn
 
-from ..calc import static
-from .new_io import marker_dtype, load_c3d, loadVSK
-from .pycgmIO import loadData
+from .calibration_store import CalibrationStore, calibrate
+from .new_io import marker_dtype, load_c3d_analog, probe_c3d
+from .trial import Columns, Subject, Trial, load_markers, trial_name
 
 
-def structure_model(static_trial_filename, dynamic_trials, measurement_filename, axis_result_keys, angle_result_keys):
-    '''Create a structured array containing a model's data
+def load_subject(static_trial_filename, dynamic_trials, measurement_filename, axis_result_keys, angle_result_keys, mmap=False, markers=None, analog=False, workers=None, cache_dir=None,
+                 static_estimator='mean', stance_window=None, calibration=None, dtype=np.float64, point_result_keys=()):
+    '''Load a subject's calibration and dynamic trials into columnar containers
 
     Parameters
     ----------
     static_trial_filename : str
-        Filename of the static trial .c3d
+        Filename of the static trial .c3d. Unused if `calibration` is given.
 
     dynamic_trials : str or list of str
         Filename or list of filenames of dynamic trial .c3d(s)
 
     measurement_filename : str
-        Filename of the subject measurement .vsk
+        Filename of the subject measurement .vsk. Unused if `calibration` is given.
 
     axis_result_keys : list of str
         A list containing the names of the model's returned axes
@@ -29,100 +30,157 @@ def structure_model(static_trial_filename, dynamic_trials, measurement_filename,
     angle_result_keys : list of str
         A list containing the names of the model's returned angles
 
+    mmap : bool, optional
+        Set to True to memory-map the dynamic trials instead of decoding them.
+        Each trial's markers field then holds a new_io.MappedMarkers, which
+        decodes markers individually the first time they are used.
+
+    markers : list of str, optional
+        Names of the markers to be loaded from the dynamic trials.
+        Loads every marker by default.
+
+    analog : bool, optional
+        Set to True to also load the analog channels of the dynamic trials,
+        e.g. force plate data for kinetics.
+
+    workers : int, optional
+        Number of threads used to load the trials. The static trial and each
+        dynamic trial are decoded concurrently, since decoding is mostly file
+        reads and NumPy calls that release the GIL. Set to 1 to load the trials
+        one after another. Defaults to the ThreadPoolExecutor default.
+
+    cache_dir : str, optional
+        Directory of an on-disk cache of decoded trials and calibrated
+        measurements. Trials and measurements whose files have not changed
+        since they were cached are memory-mapped from the cache instead of
+        being decoded and calibrated again. Memory-mapped dynamic trials
+        (`mmap`) are never cached. No cache is used by default.
+
+    static_estimator : {'mean', 'median', 'trimmed'}, optional
+        Estimator of the inter-ASIS distance and knee and ankle widths
+        measured from the static trial when the .vsk has none.
+        See calc.calibration.estimate. The default is 'mean'.
+
+    stance_window : int, optional
+        If set, calibrate from only the `stance_window` consecutive static
+        frames in which the subject is most still. Every frame is used by default.
+
+    calibration : calibration_store.Calibration, optional
+        A precomputed calibration of the subject. Its static trial and
+        measurements are used as they are, instead of loading and calibrating
+        the static trial. See calibration_store.calibrate.
+
+    dtype : dtype, optional
+        Float type of the dynamic trials' markers, axes and angles.
+        np.float32 halves the memory of a session. The default is np.float64.
+
+    point_result_keys : list of str, optional
+        Names of the returned axes that are stored as (frames, 3) points,
+        e.g. joint centers
+
     Returns
     -------
-    model : structured array
-        Structured array containing the model's measurements, static trial,
-        and dynamic trial(s)
-
-    Notes
-    -----
-    Accessing measurement data:
-        model.static.measurements.{measurement name}
-        e.g. model.static.measurements.LeftLegLength
-
-    Accessing static trial data:
-        model.static.markers.{marker name}.point.{x, y, z}
-        e.g. model.static.markers.LASI.point.x
-
-    Accessing dynamic trial data:
-        model.dynamic.{filename}.markers.{marker name}.point.{x, y, z}
-        e.g. model.RoboWalk.markers.LASI.point.x
-        e.g. model.RoboWalk.axes.Pelvis
-        e.g. model.RoboWalk.angles.RHip
+    subject : trial.Subject
+        The subject's calibration, and a trial.Trial with allocated axes
+        and angles for each dynamic trial
     '''
 
-    def structure_measurements(measurements):
-        sm_names = measurements[0]
-        sm_dtype = []
-        for key in sm_names:
-            if key == "GCS":
-                sm_dtype.append((key, 'f8', (3,3)))
-            else:
-                sm_dtype.append((key, 'f8'))
-        measurements_struct = np.array(tuple(measurements[1]), dtype=sm_dtype)
-        return measurements_struct
-
     if isinstance(dynamic_trials, str):
         dynamic_trials = [dynamic_trials]
 
     start = time.time()
 
 
-    # HACK
-    # load static trial, measurements for use in getStatic (has not been refactored)
-    old_static_data = loadData(static_trial_filename)
-    uncalibrated_measurements = loadVSK(measurement_filename)
-    uncalibrated_measurements_dict = dict(zip(uncalibrated_measurements[0], uncalibrated_measurements[1]))
+    def load_static_trial():
+        if calibration is not None:
+            return calibration
 
-    # calibrate subject measurements
-    calibrated_measurements_dict = static.getStatic(old_static_data, uncalibrated_measurements_dict)
-    calibrated_measurements_split = [list(calibrated_measurements_dict.keys()), list(calibrated_measurements_dict.values())]
+        return calibrate(static_trial_filename, measurement_filename, store, static_estimator, stance_window)
 
-    measurements_struct = structure_measurements(calibrated_measurements_split)
-    static_trial = load_c3d(static_trial_filename)
+    def load_marker_struct(filename, markers, dtype):
+        return load_markers(filename, markers=markers, dtype=dtype)[0].struct()
 
-    dynamic_dtype = []
-    marker_structs = []
-    parsed_filenames = []
+    def load_dynamic_trial(filename):
+        if cache is None or mmap:
+            return load_markers(filename, markers=markers, mmap=mmap, dtype=dtype)
 
-    for trial_name in dynamic_trials:
-        dynamic_trial, num_frames = load_c3d(trial_name, return_frame_count=True)
+        # the (markers, frames, 3) block is cached as a struct of one field per marker
+        marker_struct = cache.cached('points', [filename], load_marker_struct, filename, markers=markers, dtype=np.dtype(dtype).str)
+        marker_columns = Columns.from_struct(marker_struct)
 
-        marker_dtype = dynamic_trial.dtype
-        axes_dtype   = np.dtype([(key, 'f8', (num_frames, 3, 4)) for key in axis_result_keys])
-        angles_dtype = np.dtype([(key, 'f8', (num_frames, 3)) for key in angle_result_keys])
+        return marker_columns, np.arange(marker_columns.block.shape[1]), probe_c3d(filename)['frame_rate']
 
-        # parse just the name of the trial
-        filename = re.findall(r'[^\/]+(?=\.)', trial_name)[0]
-        parsed_filenames.append(filename)
+    # calibrations share the directory of the trial cache
+    store = CalibrationStore(cache_dir) if cache_dir is not None else None
+    cache = store.cache if store is not None else None
 
-        marker_structs.append(dynamic_trial)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        static_trial_future = pool.submit(load_static_trial)
 
-        trial_dtype = [('markers', marker_dtype),
-                       ('axes',    axes_dtype),
-                       ('angles',  angles_dtype)]
+        dynamic_trial_futures = [pool.submit(load_dynamic_trial, filename) for filename in dynamic_trials]
 
-        dynamic_dtype.append((filename, trial_dtype))
+        if analog:
+            analog_futures = [pool.submit(load_c3d_analog, filename) for filename in dynamic_trials]
 
+        subject_calibration = static_trial_future.result()
+        dynamic_trial_results = [future.result() for future in dynamic_trial_futures]
+        analog_arrays = [future.result() for future in analog_futures] if analog else []
 
-    model_dtype = [('static', [('markers', static_trial.dtype), \
-                               ('measurements', measurements_struct.dtype)]), \
-                   ('dynamic', dynamic_dtype)]
+    trials = {}
+    for i, filename in enumerate(dynamic_trials):
+        marker_columns, frame_numbers, frame_rate = dynamic_trial_results[i]
+        analog_data, analog_labels = analog_arrays[i] if analog else (None, None)
 
-    model = np.zeros((1), dtype=model_dtype)
-    model['static']['markers'] = static_trial
-    model['static']['measurements'] = measurements_struct
-
-    for i, trial_name in enumerate(parsed_filenames):
-        model['dynamic'][trial_name]['markers'] = marker_structs[i]
-
-    model = model.view(np.recarray)
+        name = trial_name(filename)
+        trials[name] = Trial(name, marker_columns, frame_numbers, axis_result_keys, angle_result_keys,
+                             analog=analog_data, analog_labels=analog_labels, frame_rate=frame_rate, dtype=dtype,
+                             point_keys=point_result_keys)
 
     end = time.time()
     print(f'Total time to load and structure model: {end-start}\n')
 
-    return model
+    return Subject(subject_calibration, trials)
+
+
+def structure_model(static_trial_filename, dynamic_trials, measurement_filename, axis_result_keys, angle_result_keys, mmap=False, markers=None, analog=False, workers=None, cache_dir=None,
+                    static_estimator='mean', stance_window=None, calibration=None, dtype=np.float64, point_result_keys=()):
+    '''Create a structured array containing a model's data
+
+    Takes the same parameters as `load_subject`, and copies the loaded
+    subject into a single nested recarray.
+
+    Returns
+    -------
+    model : structured array
+        Structured array containing the model's measurements, static trial,
+        and dynamic trial(s)
+
+    Notes
+    -----
+    Accessing measurement data:
+        model.static.measurements.{measurement name}
+        e.g. model.static.measurements.LeftLegLength
+
+    Accessing static trial data:
+        model.static.markers.{marker name}.point.{x, y, z}
+        e.g. model.static.markers.LASI.point.x
+
+    Accessing dynamic trial data:
+        model.dynamic.{filename}.markers.{marker name}.point.{x, y, z}
+        e.g. model.RoboWalk.markers.LASI.point.x
+        e.g. model.RoboWalk.axes.Pelvis
+        e.g. model.RoboWalk.angles.RHip
+
+    Accessing dynamic trial analog data, if loaded:
+        model.dynamic.{filename}.analog is a (samples, channels) array
+        model.dynamic.{filename}.analog_labels holds the channel labels
+        e.g. model.RoboWalk.analog[0][:, 2]
+    '''
+
+    return load_subject(static_trial_filename, dynamic_trials, measurement_filename, axis_result_keys, angle_result_keys,
+                        mmap=mmap, markers=markers, analog=analog, workers=workers, cache_dir=cache_dir,
+                        static_estimator=static_estimator, stance_window=stance_window, calibration=calibration,
+                        dtype=dtype, point_result_keys=point_result_keys).records()
 
 
 def get_markers(arr, names, points_only=True, debug=False):
@@ -239,6 +297,10 @@ def update_subject_struct(subject, modified_trial_name, with_virtual_markers):
         else:
             new_subject['dynamic'][trial_name]['markers'] = subject.dynamic[trial_name].markers
 
+            if 'analog' in subject.dynamic[trial_name].dtype.names:
+                new_subject['dynamic'][trial_name]['analog'] = subject.dynamic[trial_name].analog
+                new_subject['dynamic'][trial_name]['analog_labels'] = subject.dynamic[trial_name].analog_labels
+
     new_subject = new_subject.view(np.recarray)
 
     end = time.time()
@@ -250,7 +312,21 @@ def update_subject_struct(subject, modified_trial_name, with_virtual_markers):
 def add_dynamic_marker(subject, dynamic_trial_name, marker_name, marker_data):
     """ 
     TODO consider whether or not marker_data already has frame numbers, add if not
+
+    A trial.Subject is extended in place: the marker is appended to the
+    trial's marker registry and the subject is returned as it is. A
+    recarray subject is copied into a new recarray with the marker added.
     """ 
+    if isinstance(subject, Subject):
+        marker_data = np.asarray(marker_data)
+        if marker_data.dtype.names is not None:
+            # structured marker data, as made for add_virtual_marker
+            marker_data = rfn.structured_to_unstructured(marker_data['point'])
+
+        subject.dynamic[dynamic_trial_name].add_marker(marker_name, marker_data.reshape(-1, 3))
+
+        return subject
+
     with_added_marker = add_virtual_marker(subject.dynamic[dynamic_trial_name], marker_name, marker_data)
     new_subject = update_subject_struct(subject, dynamic_trial_name, with_added_marker)
 
@@ -0,0 +1,727 @@
+"""
+Columnar containers of a subject's trial data.
+
+The markers of a trial are one contiguous (markers, frames, 3) block with
+the name of each row kept in a separate index, so looking up a marker is a
+zero-copy slice of the block. Virtual markers are appended to spare rows
+of a second block, see `MarkerRegistry`. Axes, points and angles are allocated one
+by one, when a function first returns them, and can be freed once they
+are no longer needed. Joint centers are points, (frames, 3) arrays, rather
+than axes whose x, y and z axes are all zeros. The nested structured recarray of structure_model is only
+built on request, by `Subject.records`.
+"""
+
+import re
+import time
+
+import numpy as np
+
+from . import c3d_backends
+from .new_io import MappedMarkers, marker_dtype
+
+
+class Columns():
+    """Named rows of one contiguous block.
+
+    Parameters
+    ----------
+    names : list of str
+        Name of each row of `block`.
+    block : ndarray
+        An (n, frames, ...) array, e.g. (markers, frames, 3) marker positions
+        or (axes, frames, 3, 4) axes.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from .trial import Columns
+    >>> markers = Columns(['RASI', 'LASI'], np.zeros((2, 100, 3)))
+    >>> markers['LASI'].shape
+    (100, 3)
+    >>> np.shares_memory(markers['LASI'], markers.block)
+    True
+    """
+
+    def __init__(self, names, block):
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.block = block
+
+    @classmethod
+    def from_struct(cls, struct):
+        """Wrap a structured array made by `struct`, without copying it."""
+        names = struct.dtype.names
+        shape = struct.dtype[0].shape
+        return cls(names, struct.view(struct.dtype[0].base).reshape((len(names),) + shape))
+
+    def __getitem__(self, name):
+        return self.block[self.index[name]]
+
+    def __setitem__(self, name, value):
+        self.block[self.index[name]] = value
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name, default=None):
+        if name not in self.index:
+            return default
+
+        return self.block[self.index[name]]
+
+    @property
+    def nbytes(self):
+        return self.block.nbytes
+
+    def struct(self):
+        """Structured array of the rows, with one field per name.
+
+        The fields share the memory of the block, which is laid out
+        exactly like a structured array of back to back fields.
+        """
+        dtype = [(name, self.block.dtype, self.block.shape[1:]) for name in self.names]
+        return np.ascontiguousarray(self.block).reshape(-1).view(dtype)
+
+
+class MarkerRegistry():
+    """Stored markers, and virtual markers appended after them.
+
+    The stored markers stay in their read-only `Columns` block, which is
+    never copied. Virtual markers are kept in a separate block with spare
+    capacity, which doubles when it runs out. Appending a marker only
+    writes its own row, so adding n markers copies O(n * frames) data in
+    total, instead of the whole trial for each marker. Markers cannot be
+    removed, but their positions can be overwritten with `write`. An
+    edited stored marker is held as a copy of its own.
+
+    Parameters
+    ----------
+    stored : Columns
+        The (markers, frames, 3) positions of the stored markers. Not copied.
+    capacity : int, optional
+        Number of virtual markers to make room for.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from .trial import Columns, MarkerRegistry
+    >>> stored = Columns(['RASI', 'LASI'], np.zeros((2, 100, 3)))
+    >>> markers = MarkerRegistry(stored)
+    >>> markers.append('MidASIS', (markers['RASI'] + markers['LASI']) / 2)
+    >>> markers.names, markers.capacity
+    (['RASI', 'LASI', 'MidASIS'], 1)
+    >>> np.shares_memory(markers['RASI'], stored.block)
+    True
+    """
+
+    def __init__(self, stored, capacity=0):
+        self.stored = stored
+        self.names = list(stored.names)
+        self.dtype = stored.block.dtype
+
+        # rows below len(stored) are in the stored block, the others in `storage`
+        self.index = dict(stored.index)
+        self.count = 0
+        self.storage = np.empty((capacity,) + stored.block.shape[1:], dtype=self.dtype)
+        self.edited = {}
+
+    def __getitem__(self, name):
+        if name in self.edited:
+            markers = self.edited[name].view()
+            markers.flags.writeable = False
+            return markers
+
+        row = self.index[name]
+        if row < len(self.stored):
+            return self.stored.block[row]
+
+        return self.rows()[row - len(self.stored)]
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name, default=None):
+        if name not in self.index:
+            return default
+
+        return self[name]
+
+    @property
+    def capacity(self):
+        return len(self.storage)
+
+    @property
+    def nbytes(self):
+        return self.stored.nbytes + self.storage.nbytes + sum(markers.nbytes for markers in self.edited.values())
+
+    def rows(self):
+        """Read-only view of the virtual rows in use."""
+        block = self.storage[:self.count]
+        block.flags.writeable = False
+        return block
+
+    def reserve(self, capacity):
+        """Make room for at least `capacity` virtual markers."""
+        if capacity <= self.capacity:
+            return
+
+        storage = np.empty((capacity,) + self.storage.shape[1:], dtype=self.dtype)
+        storage[:self.count] = self.storage[:self.count]
+        self.storage = storage
+
+    def append(self, name, positions):
+        """Append a marker, given its (frames, 3) positions."""
+        self.extend({name: positions})
+
+    def extend(self, markers):
+        """Append markers, given a dict mapping each new name to its (frames, 3) positions.
+
+        Raises
+        ------
+        ValueError
+            If a marker is already in the registry, or its positions are
+            not (frames, 3). No marker is appended then.
+        """
+        markers = {name: np.asarray(positions, dtype=self.dtype) for name, positions in markers.items()}
+
+        for name, positions in markers.items():
+            if name in self.index:
+                raise ValueError(f'Marker {name} is already in the trial')
+            if positions.shape != self.storage.shape[1:]:
+                raise ValueError(f'{name} has shape {positions.shape}, expected {self.storage.shape[1:]}')
+
+        if self.count + len(markers) > self.capacity:
+            self.reserve(max(self.count + len(markers), 2 * self.capacity))
+
+        for name, positions in markers.items():
+            self.index[name] = len(self.stored) + self.add_row(positions)
+            self.names.append(name)
+
+    def add_row(self, positions):
+        """Write positions to the next free virtual row, and return the row."""
+        if self.count == self.capacity:
+            self.reserve(max(1, 2 * self.capacity))
+
+        self.storage[self.count] = positions
+        self.count += 1
+
+        return self.count - 1
+
+    def write(self, name, frames, positions):
+        """Overwrite the positions of a marker over some frames.
+
+        Virtual markers are written in place. A stored marker is copied the
+        first time it is written, as in `new_io.MappedMarkers.write`, so
+        the stored block is left unchanged.
+
+        Parameters
+        ----------
+        name : str
+        frames : slice or array of int
+            Frames to overwrite, e.g. slice(100, 120).
+        positions : ndarray
+            The (frames, 3) positions of the marker over `frames`.
+        """
+        row = self.index[name]
+        if row >= len(self.stored):
+            self.storage[row - len(self.stored), frames] = positions
+            return
+
+        if name not in self.edited:
+            self.edited[name] = self.stored.block[row].copy()
+
+        self.edited[name][frames] = positions
+
+
+class Outputs():
+    """Named outputs of a trial, allocated when they are first written.
+
+    Each output is its own (frames, ...) array. Arrays written by a
+    function are kept as they are, without copying them into a block.
+    Reading an output that has not been written, or was freed, raises
+    a KeyError.
+
+    Attributes
+    ----------
+    computed : set of str
+        Names of the outputs written over every frame, e.g. by a function
+        run by plan.ExecutionPlan.execute. Outputs allocated with
+        `allocate` and written over some frames only are not computed.
+
+    Parameters
+    ----------
+    names : list of str
+        Names of the outputs that may be written.
+    shape : tuple of int
+        Shape of each output, e.g. (frames, 3, 4) for axes.
+    dtype : dtype, optional
+        Float type of the outputs. The default is float64.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from .trial import Outputs
+    >>> angles = Outputs(['RHip', 'LHip'], (100, 3))
+    >>> angles.nbytes
+    0
+    >>> angles['RHip'] = np.ones((100, 3))
+    >>> angles.nbytes
+    2400
+    """
+
+    def __init__(self, names, shape, dtype=np.float64):
+        self.names = list(names)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.arrays = {}
+        self.computed = set()
+
+    def __getitem__(self, name):
+        if name not in self.arrays:
+            if name not in self.names:
+                raise KeyError(name)
+
+            # e.g. read by a function run out of order, or after it was freed
+            raise KeyError(f'{name} has not been computed, or was freed')
+
+        return self.arrays[name]
+
+    def allocate(self, name):
+        """Get an output, allocating it as zeros if it has not been written."""
+        if name not in self.names:
+            raise KeyError(name)
+
+        if name not in self.arrays:
+            self.arrays[name] = np.zeros(self.shape, self.dtype)
+
+        return self.arrays[name]
+
+    def __setitem__(self, name, value):
+        if name not in self.names:
+            raise KeyError(name)
+
+        value = np.asarray(value, dtype=self.dtype)
+        if value.shape != self.shape:
+            raise ValueError(f'{name} has shape {value.shape}, expected {self.shape}')
+
+        if not value.flags.writeable:
+            # e.g. a marker returned as it is
+            value = value.copy()
+
+        self.arrays[name] = value
+        self.computed.add(name)
+
+    def __delitem__(self, name):
+        self.arrays.pop(name, None)
+        self.computed.discard(name)
+
+    def declare(self, names):
+        """Replace the names of the outputs that may be written.
+
+        Outputs that keep their name keep their arrays, those no longer
+        named are freed. New outputs are allocated when first written.
+        """
+        self.names = list(names)
+        for name in list(self.arrays):
+            if name not in self.names:
+                del self[name]
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def get(self, name, default=None):
+        """Get an output if it has been written, `default` otherwise."""
+        return self.arrays.get(name, default)
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def struct_dtype(self):
+        return np.dtype([(name, self.dtype, self.shape) for name in self.names])
+
+    def struct(self):
+        """Copy the outputs into a structured array with one field per name.
+
+        Outputs that were never written, or were freed, are zeros.
+        """
+        struct = np.zeros((1), dtype=self.struct_dtype())
+        for name, array in self.arrays.items():
+            struct[name] = array
+
+        return struct
+
+
+class Trial():
+    """Columnar data of a dynamic trial.
+
+    Attributes
+    ----------
+    name : str
+        Name of the trial, the filename without its directory and extension.
+    markers : Columns, MarkerRegistry or MappedMarkers
+        Maps each marker name to a (frames, 3) array of its positions.
+        Stored markers are read-only, since the same arrays are passed to
+        every function that uses them. Columns become a MarkerRegistry
+        once a virtual marker is added, see `add_markers`.
+    frame_numbers : ndarray
+        Frame index of each frame, counted from the first frame in the file.
+        Shared by every marker, axis and angle of the trial.
+    frame_rate : float or None
+        Frames per second, if known.
+    axes : Outputs
+        Maps each axis name to its (frames, 3, 4) output.
+    points : Outputs
+        Maps each point name, e.g. 'RHipJC', to its (frames, 3) output.
+        See `axis` for a point in the layout of an axis.
+    angles : Outputs
+        Maps each angle name to its (frames, 3) output.
+    analog : ndarray or None
+        (samples, channels) analog data, if loaded.
+    analog_labels : list of str or None
+        Label of each analog channel, if loaded.
+    dtype : dtype
+        Float type of the axes, points and angles, float64 unless given otherwise.
+    """
+
+    def __init__(self, name, markers, frame_numbers, axis_keys=(), angle_keys=(), analog=None, analog_labels=None,
+                 frame_rate=None, dtype=np.float64, point_keys=()):
+        self.name = name
+        self.markers = markers
+        self.frame_numbers = frame_numbers
+        self.frame_rate = frame_rate
+        self.num_frames = len(frame_numbers)
+        self.analog = analog
+        self.analog_labels = analog_labels
+        self.dtype = np.dtype(dtype)
+
+        if isinstance(markers, Columns):
+            markers.block.flags.writeable = False
+
+        self.allocate(axis_keys, angle_keys, point_keys)
+
+    def allocate(self, axis_keys, angle_keys, point_keys=()):
+        """Declare the named axes, points and angles. Their arrays are allocated when written.
+
+        `axis_keys` names every returned axis, including those in
+        `point_keys`, which are stored as points.
+        """
+        self.axes = Outputs((), (self.num_frames, 3, 4), self.dtype)
+        self.points = Outputs((), (self.num_frames, 3), self.dtype)
+        self.angles = Outputs((), (self.num_frames, 3), self.dtype)
+
+        self.declare(axis_keys, angle_keys, point_keys)
+
+    def declare(self, axis_keys, angle_keys, point_keys=()):
+        """Update the names of the axes, points and angles, e.g. after a function is added to a model.
+
+        Outputs already written keep their arrays, unless they are no
+        longer named. See `allocate`.
+        """
+        self.axis_names = list(axis_keys)
+        self.axes.declare([key for key in axis_keys if key not in point_keys])
+        self.points.declare([key for key in axis_keys if key in point_keys])
+        self.angles.declare(angle_keys)
+
+    def free(self, outputs):
+        """Free outputs, given as ('axes', name), ('points', name) or ('angles', name)."""
+        for kind, name in outputs:
+            del getattr(self, kind)[name]
+
+    @property
+    def times(self):
+        """Time of each frame in seconds, or None if the frame rate is unknown."""
+        if not self.frame_rate:
+            return None
+
+        return self.frame_numbers / self.frame_rate
+
+    @property
+    def nbytes(self):
+        """Bytes held by the trial's markers, axes, points and angles."""
+        nbytes = self.axes.nbytes + self.points.nbytes + self.angles.nbytes
+
+        if isinstance(self.markers, (Columns, MarkerRegistry)):
+            nbytes += self.markers.nbytes
+        else:
+            nbytes += sum(points.nbytes for points in self.markers.decoded.values())
+
+        return nbytes
+
+    def marker(self, name):
+        """Get a (frames, 3) view of a marker, or None if it is not in the trial."""
+        if name not in self.markers:
+            return None
+
+        return self.markers[name]
+
+    def add_marker(self, name, positions):
+        """Add a virtual marker, given its (frames, 3) positions. See `add_markers`."""
+        self.add_markers({name: positions})
+
+    def add_markers(self, markers):
+        """Add virtual markers, e.g. midpoints or cluster centroids.
+
+        Each marker is appended to the trial's markers without copying the
+        stored markers, or the other virtual markers apart from an
+        occasional doubling of their capacity. Other trials of the subject
+        are left untouched.
+
+        Parameters
+        ----------
+        markers : dict
+            Maps the name of each new marker to its (frames, 3) positions.
+
+        Raises
+        ------
+        ValueError
+            If a marker is already in the trial, or its positions are not (frames, 3).
+
+        Examples
+        --------
+        >>> trial.add_markers({'MidASIS': (trial.marker('RASI') + trial.marker('LASI')) / 2}) #doctest: +SKIP
+        """
+        if isinstance(self.markers, MappedMarkers):
+            self.markers.extend(markers)
+            return
+
+        if not isinstance(self.markers, MarkerRegistry):
+            self.markers = MarkerRegistry(self.markers)
+
+        self.markers.extend(markers)
+
+    def edit_marker(self, name, frames, positions):
+        """Overwrite the positions of a marker over some frames, e.g. to fix a gap or a swapped label.
+
+        Stored markers are read-only. The trial's markers are wrapped in a
+        MarkerRegistry, without copying them, and an edited stored marker
+        is copied on its first edit. Markers mapped from a file are only
+        changed in memory.
+
+        Parameters
+        ----------
+        name : str
+            Name of a marker in the trial.
+        frames : slice or array of int
+            Frames to overwrite, e.g. slice(100, 120).
+        positions : ndarray
+            The (frames, 3) positions of the marker over `frames`.
+
+        Raises
+        ------
+        KeyError
+            If the marker is not in the trial.
+        """
+        if name not in self.markers:
+            raise KeyError(name)
+
+        if not isinstance(self.markers, (MappedMarkers, MarkerRegistry)):
+            self.markers = MarkerRegistry(self.markers)
+
+        self.markers.write(name, frames, positions)
+
+    def axis(self, name):
+        """Get an axis, or a point as an axis whose x, y and z axes are zeros.
+
+        The (frames, 3, 4) axis of a point is a copy, made on each call.
+        """
+        if name in self.points:
+            return point_axis(self.points[name])
+
+        return self.axes[name]
+
+    def axes_struct_dtype(self):
+        return np.dtype([(name, self.dtype, (self.num_frames, 3, 4)) for name in self.axis_names])
+
+    def axes_struct(self):
+        """Copy the axes and points into a structured array of axes, in the order they were declared."""
+        struct = np.zeros((1), dtype=self.axes_struct_dtype())
+        for name, array in self.axes.arrays.items():
+            struct[name] = array
+        for name, array in self.points.arrays.items():
+            struct[name][..., 3] = array
+
+        return struct
+
+    def marker_struct(self):
+        """Copy the markers into a structured array in the layout of new_io.load_c3d."""
+        struct = np.empty((1), dtype=self.marker_struct_dtype())
+
+        marker_positions = struct.view(np.float64).reshape(len(self.markers), self.num_frames, 4)
+        marker_positions[:, :, 0] = self.frame_numbers
+        for row, name in enumerate(self.markers.names):
+            marker_positions[row, :, 1:] = self.markers[name]
+
+        return struct
+
+    def marker_struct_dtype(self):
+        return np.dtype([(key, (marker_dtype(), (self.num_frames,))) for key in self.markers.names])
+
+    def records_dtype(self):
+        """Get the dtype of the trial in the recarray of `Subject.records`."""
+        markers_dtype = 'O' if isinstance(self.markers, MappedMarkers) else self.marker_struct_dtype()
+
+        trial_dtype = [('markers', markers_dtype),
+                       ('axes',    self.axes_struct_dtype()),
+                       ('angles',  self.angles.struct_dtype())]
+
+        if self.analog is not None:
+            trial_dtype += [('analog',        'f8', self.analog.shape),
+                            ('analog_labels', 'U32', (len(self.analog_labels),))]
+
+        return trial_dtype
+
+    def fill_records(self, record):
+        """Copy the trial into its field of a `Subject.records` recarray."""
+        if isinstance(self.markers, MappedMarkers):
+            record['markers'][0] = self.markers
+        else:
+            record['markers'] = self.marker_struct()
+
+        record['axes'] = self.axes_struct()
+        record['angles'] = self.angles.struct()
+
+        if self.analog is not None:
+            record['analog'] = self.analog
+            record['analog_labels'] = self.analog_labels
+
+
+class Subject():
+    """A subject's calibration and dynamic trials.
+
+    Attributes
+    ----------
+    calibration : calibration_store.Calibration
+        The static trial and calibrated measurements.
+    dynamic : dict
+        Maps each trial name to its Trial, in the order the trials were given.
+    """
+
+    def __init__(self, calibration, dynamic):
+        self.calibration = calibration
+        self.dynamic = dynamic
+
+    def measurement(self, name):
+        """Get a calibrated measurement, or None if the subject does not have it."""
+        measurements = self.calibration.measurements
+        if name not in measurements.dtype.names:
+            return None
+
+        return measurements.reshape(-1)[0][name]
+
+    def records(self):
+        """Copy the subject into the nested recarray layout of structure_model.
+
+        Returns
+        -------
+        model : recarray
+            model.static.markers, model.static.measurements and
+            model.dynamic.{trial name}.{markers, axes, angles}
+        """
+        static_trial = self.calibration.static_trial
+        measurements_struct = self.calibration.measurements
+
+        dynamic_dtype = [(name, trial.records_dtype()) for name, trial in self.dynamic.items()]
+
+        model_dtype = [('static', [('markers', static_trial.dtype), \
+                                   ('measurements', measurements_struct.dtype)]), \
+                       ('dynamic', dynamic_dtype)]
+
+        model = np.zeros((1), dtype=model_dtype)
+        model['static']['markers'] = static_trial
+        model['static']['measurements'] = measurements_struct
+
+        for name, trial in self.dynamic.items():
+            trial.fill_records(model['dynamic'][name])
+
+        return model.view(np.recarray)
+
+
+def point_axis(point):
+    """Lay out (frames, 3) points as (frames, 3, 4) axes with zero x, y and z axes.
+
+    Examples
+    --------
+    >>> import numpy as np
+    >>> from .trial import point_axis
+    >>> point_axis(np.array([[1., 2., 3.]]))
+    array([[[0., 0., 0., 1.],
+            [0., 0., 0., 2.],
+            [0., 0., 0., 3.]]])
+    """
+    axis = np.zeros(point.shape + (4,), dtype=point.dtype)
+    axis[..., 3] = point
+
+    return axis
+
+
+def trial_name(filename):
+    """Get the name of a trial from its filename, e.g. 'RoboWalk'."""
+    return re.findall(r'[^\/]+(?=\.)', filename)[0]
+
+
+def load_markers(filename, markers=None, frames=None, mmap=False, backend=None, dtype=np.float64):
+    """Load the markers of a c3d file into columns.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the c3d file to be loaded.
+    markers : list of str, optional
+        Names of the markers to be loaded. Loads every marker by default.
+    frames : slice, optional
+        Window of frames to be loaded. Loads every frame by default.
+    mmap : bool, optional
+        Set to True to memory-map the file. Markers are then decoded
+        individually, the first time they are used.
+    backend : str, optional
+        Name of the c3d backend to read the file with.
+        See c3d_backends.get_backend.
+    dtype : dtype, optional
+        Float type the positions are stored as. float32 halves the memory
+        of a trial, at about 7 significant digits, i.e. micrometers at the
+        scale of a capture volume. The default is float64.
+
+    Returns
+    -------
+    markers : Columns or MappedMarkers
+        The (markers, frames, 3) positions of the markers.
+    frame_numbers : ndarray
+        Frame index of each frame.
+    frame_rate : float
+        Frames per second.
+    """
+    start = time.time()
+
+    engine = c3d_backends.get_backend(backend, mmap=mmap)
+
+    if mmap:
+        marker_index, raw, scale, _, frame_numbers, frame_rate = engine.map_points(filename, markers, frames)
+        columns = MappedMarkers(raw, marker_index, scale, frame_numbers, dtype)
+    else:
+        points = engine.read_points(filename, markers, frames)
+        frame_numbers, frame_rate = points.frame_numbers, points.frame_rate
+        columns = Columns(points.labels, np.ascontiguousarray(points.points.transpose(1, 0, 2), dtype=dtype))
+
+    end = time.time()
+    print(f'Time to read/structure {filename}: {end - start}')
+
+    return columns, frame_numbers, frame_rate
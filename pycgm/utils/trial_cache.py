@@ -0,0 +1,223 @@
+"""
+On-disk cache of decoded trials and calibrated measurements.
+
+Entries are files named after a hash of the contents of the files they
+were made from, so an entry is used until one of those files changes.
+Cached arrays are loaded as memory maps instead of being decoded again.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+
+import numpy as np
+
+# Bump when the layout of anything stored in the cache changes,
+# so that entries written by older versions are no longer found
+CACHE_VERSION = 1
+
+# Data of an entry starts at a multiple of this many bytes
+ALIGNMENT = 64
+
+
+def file_digest(filename, chunk_size=1 << 20):
+    """Get the sha1 hex digest of a file's contents."""
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(chunk_size), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+class TrialCache():
+    """Cache of structured arrays in a directory.
+
+    Parameters
+    ----------
+    directory : str
+        Directory holding the cache entries. Created if it does not exist.
+
+    Examples
+    --------
+    >>> cache = TrialCache('.pycgm_cache') #doctest: +SKIP
+    >>> trial = cache.cached('markers', ['RoboWalk.c3d'], load_c3d, 'RoboWalk.c3d') #doctest: +SKIP
+
+    A marker struct in the layout of new_io.load_c3d is read back as it was saved:
+
+    >>> import tempfile
+    >>> import numpy as np
+    >>> from .new_io import marker_dtype
+    >>> from .trial_cache import TrialCache
+    >>> cache = TrialCache(tempfile.mkdtemp())
+    >>> markers = np.zeros(1, dtype=[(name, (marker_dtype(), (100,))) for name in ['RASI', 'LASI']])
+    >>> markers['LASI']['point']['z'] = 1036.8
+    >>> cache.save('markers-example', markers)
+    >>> loaded = cache.load('markers-example')
+    >>> loaded.dtype == markers.dtype, loaded.shape, np.array_equal(loaded, markers)
+    (True, (1,), True)
+    >>> cache.load('missing') is None
+    True
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.digests = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def digest(self, filename):
+        """Get the digest of a file, hashing each file only once per cache."""
+        stat = os.stat(filename)
+        stamp = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+
+        if stamp not in self.digests:
+            self.digests[stamp] = file_digest(filename)
+
+        return self.digests[stamp]
+
+    def key(self, kind, filenames, **options):
+        """Get the cache key of an entry.
+
+        Parameters
+        ----------
+        kind : str
+            What is stored, e.g. 'markers' or 'measurements'.
+        filenames : list of str
+            Files the entry is made from.
+        **options
+            Any other arguments that change the stored array, e.g. markers=[...]
+
+        Returns
+        -------
+        key : str
+        """
+        digest = hashlib.sha1(f'{CACHE_VERSION}:{kind}'.encode())
+        for filename in filenames:
+            digest.update(self.digest(filename).encode())
+        for name in sorted(options):
+            digest.update(f'{name}={options[name]!r}'.encode())
+
+        return f'{kind}-{digest.hexdigest()}'
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.cache')
+
+    def load(self, key):
+        """Memory-map a cached array.
+
+        Returns None if the array is not in the cache, or if its entry is
+        damaged, e.g. truncated, so that it is computed and stored again.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                header_size, = struct.unpack('<Q', f.read(8))
+                if header_size > os.path.getsize(path):
+                    return None
+
+                header = json.loads(f.read(header_size))
+                dtype, shape = dtype_from_descr(header['descr']), tuple(int(size) for size in header['shape'])
+
+            offset = data_offset(header_size)
+            if os.path.getsize(path) < offset + dtype.itemsize * int(np.prod(shape)):
+                return None
+
+            if shape == ():
+                return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(1,)).reshape(())
+
+            return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape)
+
+        except (OSError, struct.error, ValueError, TypeError, KeyError, OverflowError):
+            return None
+
+    def save(self, key, array):
+        """Store an array in the cache."""
+        # ascontiguousarray makes a 0-d array 1-d
+        array = np.ascontiguousarray(array).reshape(np.shape(array))
+
+        # .npy headers spell out every field of a structured dtype, and np.load
+        # parses them slower than a trial decodes, so the dtype is stored as JSON
+        descr = array.dtype.descr if array.dtype.names else array.dtype.str
+        header = json.dumps({'descr': descr, 'shape': array.shape}).encode()
+        padding = data_offset(len(header)) - 8 - len(header)
+
+        # write to a temporary file first, so that concurrent readers
+        # never see a partly written entry
+        handle, temporary = tempfile.mkstemp(dir=self.directory, suffix='.cache')
+        with os.fdopen(handle, 'wb') as f:
+            f.write(struct.pack('<Q', len(header)))
+            f.write(header)
+            f.write(bytes(padding))
+            f.write(array.tobytes())
+        os.replace(temporary, self.path(key))
+
+    def cached(self, kind, filenames, function, *args, **options):
+        """Get an array from the cache, computing and storing it on a miss.
+
+        Parameters
+        ----------
+        kind : str
+            What is stored, e.g. 'markers'.
+        filenames : list of str
+            Files the array is made from.
+        function : callable
+            Called as function(*args, **options) to compute the array on a miss.
+
+        Returns
+        -------
+        array : memmap or array
+            The cached array, memory-mapped, or the computed one on a miss.
+        """
+        key = self.key(kind, filenames, **options)
+
+        array = self.load(key)
+        if array is None:
+            array = function(*args, **options)
+            self.save(key, array)
+
+        return array
+
+
+def dtype_from_descr(descr):
+    """Rebuild a dtype from its `descr`, read back from JSON with lists in place of tuples.
+
+    Fields without a name are padding, and only move the offset of the next field.
+
+    Examples
+    --------
+    >>> import json
+    >>> import numpy as np
+    >>> from .trial_cache import dtype_from_descr
+    >>> dtype = np.dtype([('RASI', [('frame', 'f8'), ('point', [('x', 'f8'), ('y', 'f8'), ('z', 'f8')])], (100,))])
+    >>> dtype_from_descr(json.loads(json.dumps(dtype.descr))) == dtype
+    True
+    >>> dtype_from_descr('<f4')
+    dtype('float32')
+    """
+    if isinstance(descr, str):
+        return np.dtype(descr)
+
+    names, formats, offsets, titles = [], [], [], []
+    offset = 0
+    for field in descr:
+        field_dtype = dtype_from_descr(field[1])
+        if len(field) == 3:
+            field_dtype = np.dtype((field_dtype, tuple(field[2])))
+
+        if field[0]:
+            title, name = field[0] if isinstance(field[0], list) else (None, field[0])
+            names.append(name)
+            titles.append(title)
+            formats.append(field_dtype)
+            offsets.append(offset)
+
+        offset += field_dtype.itemsize
+
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'titles': titles, 'itemsize': offset})
+
+
+def data_offset(header_size):
+    """Offset of the data of an entry whose header is `header_size` bytes."""
+    return -(-(8 + header_size) // ALIGNMENT) * ALIGNMENT
@@ -28,11 +28,14 @@ cgm = PyCGM([model, model_modified, model_extended])
 cgm.run_all()
 
 # Access model output
-print(f"{model.data.dynamic.RoboWalk.axes.Pelvis.shape=}")
-print(f"{model.data.dynamic.Sample_Dynamic.angles.RHip.shape=}")
+print(f"{model.subject.dynamic['RoboWalk'].axes['Pelvis'].shape=}")
+print(f"{model.subject.dynamic['Sample_Dynamic'].angles['RHip'].shape=}")
 
 # Indexing cgm
-print(f"{cgm[2].data.dynamic.RoboWalk.axes.REye.shape=}")
+print(f"{cgm[2].subject.dynamic['RoboWalk'].axes['REye'].shape=}")
+
+# The same output, copied into the nested recarray layout
+print(f"{model.data.dynamic.RoboWalk.axes.Pelvis.shape=}")
 
 # Compare RoboWalk output to known CSV
 diff_pycgm_csv(model, 'RoboWalk', 'pycgm/SampleData/Sample_2/pycgm_results.csv')
@@ -0,0 +1,58 @@
+"""
+Load throughput of each installed c3d backend on the SampleData files.
+
+Run from the root of the repository:
+    python speed_tests/benchmark_c3d_backends.py
+"""
+
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pycgm.utils import c3d_backends
+
+REPEATS = 5
+
+
+def time_load(backend, filename):
+    """Best time of REPEATS loads of a file, in seconds."""
+    best = float('inf')
+    for _ in range(REPEATS):
+        start = time.perf_counter()
+        trial = backend.read_points(filename)
+        best = min(best, time.perf_counter() - start)
+
+    return best, trial.points.shape[0]
+
+
+def main():
+    filenames = sorted(glob.glob('pycgm/SampleData/*/*.c3d'))
+    backends = [backend for backend in c3d_backends.BACKENDS if backend.available()]
+
+    print(f'Backends installed: {[backend.name for backend in backends]}')
+    print(f'Default backend:    {c3d_backends.get_backend().name}\n')
+    print(f'{"file":<28}{"backend":<10}{"frames":>8}{"time (s)":>12}{"MB/s":>10}{"frames/s":>12}')
+
+    totals = {backend.name: [0, 0] for backend in backends}
+
+    for filename in filenames:
+        megabytes = os.path.getsize(filename) / 1e6
+
+        for backend in backends:
+            seconds, num_frames = time_load(backend, filename)
+            totals[backend.name][0] += megabytes
+            totals[backend.name][1] += seconds
+
+            print(f'{os.path.basename(filename):<28}{backend.name:<10}{num_frames:>8}'
+                  f'{seconds:>12.5f}{megabytes / seconds:>10.1f}{num_frames / seconds:>12.0f}')
+
+    print()
+    for name, (megabytes, seconds) in totals.items():
+        print(f'{name:<10} {megabytes:.1f} MB in {seconds:.4f}s: {megabytes / seconds:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    main()
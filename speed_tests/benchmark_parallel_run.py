@@ -0,0 +1,84 @@
+"""
+Run time of Model.run with the model's functions run one at a time and in
+parallel threads, on the Test_Files movement trial repeated to a long trial.
+
+Run from the root of the repository:
+    python speed_tests/benchmark_parallel_run.py
+"""
+
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from pycgm.model.model import Model
+from pycgm.utils.trial import Columns, Trial
+
+SAMPLE = 'pycgm/SampleData/Test_Files/'
+NUM_FRAMES = 60000
+WORKERS = [2, 4, 8]
+REPEATS = 3
+
+
+def long_trial(model, trial_name, num_frames):
+    """Copy of a trial with its markers repeated to `num_frames` frames."""
+    trial = model.subject.dynamic[trial_name]
+
+    names = [name for name in model.required_marker_names() if trial.marker(name) is not None]
+    repeats = -(-num_frames // trial.num_frames)
+    block = np.stack([np.tile(trial.marker(name), (repeats, 1))[:num_frames] for name in names])
+
+    return Trial(trial_name, Columns(names, block), np.arange(num_frames), model.axis_keys, model.angle_keys,
+                 point_keys=model.point_keys)
+
+
+def time_run(model, workers):
+    """Best time of REPEATS runs of the model, in seconds."""
+    best = float('inf')
+    for _ in range(REPEATS):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            model.run(workers=workers)
+            best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def outputs(model):
+    trial = model.subject.dynamic[model.trial_names[0]]
+    return {name: trial.axis(name).copy() for name in model.axis_keys}, \
+           {name: trial.angles[name].copy() for name in model.angle_keys}
+
+
+def main():
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = Model(SAMPLE + 'Static_trial.c3d', [SAMPLE + 'Movement_trial.c3d'], SAMPLE + 'Test.vsk')
+
+    trial_name = model.trial_names[0]
+    model.subject.dynamic[trial_name] = long_trial(model, trial_name, NUM_FRAMES)
+
+    plan = model.execution_plan()
+    print(f'{NUM_FRAMES} frames, {len(plan.steps)} functions, {os.cpu_count()} CPUs\n')
+    print(f'{"workers":<10}{"time (s)":>12}{"speedup":>10}')
+
+    serial = time_run(model, None)
+    axes, angles = outputs(model)
+    print(f'{"serial":<10}{serial:>12.4f}{1:>10.2f}')
+
+    for workers in WORKERS:
+        seconds = time_run(model, workers)
+        parallel_axes, parallel_angles = outputs(model)
+
+        same = all(np.array_equal(axes[name], parallel_axes[name], equal_nan=True) for name in axes) and \
+               all(np.array_equal(angles[name], parallel_angles[name], equal_nan=True) for name in angles)
+
+        print(f'{workers:<10}{seconds:>12.4f}{serial / seconds:>10.2f}{"" if same else "  outputs differ"}')
+
+
+if __name__ == '__main__':
+    main()